@@ -6,6 +6,7 @@ from asyncpg.utils import _quote_ident
 from upwork_agent.bidder_agent import Proposal
 
 from db_utils.db_pool import get_pool,close_pool, init_pool
+from db_utils.outbox import add_outbox_event
 
 async def create_proposals_table():
     try:
@@ -90,25 +91,66 @@ async def add_proposal(uuid:int, job_url: str, job_type:str, proposal:Proposal,
     except Exception as e:
         return False, {"status" : "Failed", "message" : f"Pushing job {job_url} to db failed - {e}"}
         
-async def add_job(uuid:int, job_url: str, job_description:dict):
+async def add_job(uuid:int, job_url: str, job_description:dict, outbox_event:tuple[str, dict] = None):
+    """
+    Insert a job. `outbox_event` (endpoint, payload) is queued for the webhook
+    dispatcher in the same transaction, so a new job and its notification are
+    stored together or not at all.
+    """
     try:
         pool = await get_pool()
         async with pool.acquire() as conn:
-            await conn.execute(
-                """
-                INSERT INTO jobs (job_uuid, job_url, job_description)
-                VALUES ($1, $2, $3)
-                """,
-                uuid,
-                job_url,
-                json.dumps(job_description)
-            )
+            async with conn.transaction():
+                await conn.execute(
+                    """
+                    INSERT INTO jobs (job_uuid, job_url, job_description)
+                    VALUES ($1, $2, $3)
+                    """,
+                    uuid,
+                    job_url,
+                    json.dumps(job_description)
+                )
+                if outbox_event:
+                    endpoint, payload = outbox_event
+                    await add_outbox_event(conn, endpoint, payload)
         return True, {"status":"Job added successfully"}
     except asyncpg.UniqueViolationError:
         return True, {"status":"Exists", "message":"Job already exists"}
     except Exception as e:
         return False, {"status":"Failed", "message" : f"Pushing job {job_url} to db failed - {e}"}
         
+async def count_jobs():
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            return await conn.fetchval("SELECT count(*) FROM jobs WHERE job_uuid IS NOT NULL;")
+    except Exception as e:
+        print(f"Could not count jobs - {e}")
+        return 0
+
+async def iter_job_uuids(batch_size: int = 10000):
+    """Yield every job_uuid of the jobs table in batches, through a server side cursor."""
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            cursor = await conn.cursor("SELECT job_uuid FROM jobs WHERE job_uuid IS NOT NULL;")
+            while True:
+                rows = await cursor.fetch(batch_size)
+                if not rows:
+                    break
+                yield [row["job_uuid"] for row in rows]
+
+async def get_existing_job_uuids(uuids: list[int]) -> set[int]:
+    """The subset of `uuids` already stored in the jobs table."""
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch("SELECT job_uuid FROM jobs WHERE job_uuid = ANY($1::bigint[]);", uuids)
+            return {row["job_uuid"] for row in rows}
+    except Exception as e:
+        print(f"Could not look up job uuids - {e}")
+        return set()
+
 async def get_proposal_by_url(job_url: str):
     """
     Retrieve a proposal row from the proposals table by job_url.
@@ -130,6 +172,21 @@ async def get_proposal_by_url(job_url: str):
         print(f"Could not retrieve proposal - {e}")
         return None, None
         
+async def get_proposals_by_urls(job_urls: list[str]):
+    """
+    Retrieve the proposals of many job URLs with a single query.
+    Returns (True, {job_url: (proposal, job_type)}) for the URLs that have one, or (False, error_message).
+    """
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT job_url, job_type, proposal FROM proposals WHERE job_url = ANY($1::text[]);", job_urls
+            )
+        return True, {row["job_url"] : (Proposal.model_validate_json(row["proposal"]), row["job_type"]) for row in rows}
+    except Exception as e:
+        return False, f"Could not retrieve proposals - {e}"
+        
 async def get_job_by_url(job_url: str):
     """
     Retrieve a job row from the jobs table by job_url.
@@ -218,6 +275,31 @@ async def update_proposal_by_url(job_url: str, updates: dict):
     except Exception as e:
         return False, f"Update failed - {e}"
     
+async def update_proposals_applied(applications: list[dict]):
+    """
+    Write the applied flag and approver of many proposals in one statement.
+    Each application is a dict with job_url, applied and approved_by.
+    """
+    try:
+        if not applications:
+            return True, "No updates provided."
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            result = await conn.execute(
+                """
+                UPDATE proposals
+                SET applied = updates.applied, approved_by = updates.approved_by
+                FROM unnest($1::text[], $2::boolean[], $3::text[]) AS updates(job_url, applied, approved_by)
+                WHERE proposals.job_url = updates.job_url
+                """,
+                [application["job_url"] for application in applications],
+                [application["applied"] for application in applications],
+                [application["approved_by"] for application in applications]
+            )
+        return True, f"Update success - {result}"
+    except Exception as e:
+        return False, f"Update failed - {e}"
+    
 async def update_proposal_by_uuid(job_uuid: str, updates: dict):
     """
     Update fields in the proposals table for a given job_url.
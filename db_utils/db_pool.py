@@ -45,3 +45,12 @@ async def close_pool():
     if pool:
         await pool.close()
         pool = None
+
+async def create_listener_connection():
+    """Open a dedicated connection outside the pool for LISTEN/NOTIFY."""
+    return await asyncpg.connect(
+        user=POSTGRES_USER,
+        password=POSTGRES_PASSWORD_RAW,
+        database=POSTGRES_DB,
+        host=POSTGRES_HOST,
+    )
@@ -0,0 +1,165 @@
+import json
+from typing import Optional
+
+import asyncpg
+
+from db_utils.db_pool import get_pool
+from db_utils.queue_manager import compute_retry_delay
+from utils.constants import outbox_channel, outbox_lease_seconds, outbox_max_attempts, outbox_retry_base, outbox_retry_cap, \
+    outbox_keep_delivered_days
+
+async def create_outbox_table():
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS webhook_outbox (
+                    id BIGSERIAL PRIMARY KEY,
+                    endpoint TEXT NOT NULL,
+                    payload JSONB NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending', -- pending | delivered | dead
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    available_at TIMESTAMP NOT NULL DEFAULT NOW(), -- not picked up before this (retry delay or delivery lease)
+                    last_error TEXT,
+                    created_at TIMESTAMP DEFAULT NOW(),
+                    delivered_at TIMESTAMP
+                );
+            """)
+            await conn.execute("""
+                -- The task an event reports on, events of one task are delivered in order
+                ALTER TABLE webhook_outbox ADD COLUMN IF NOT EXISTS task_id INTEGER;
+            """)
+            await conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_webhook_outbox_pending
+                ON webhook_outbox (available_at, id) WHERE status = 'pending';
+                CREATE INDEX IF NOT EXISTS idx_webhook_outbox_pending_task
+                ON webhook_outbox (task_id, id) WHERE status = 'pending' AND task_id IS NOT NULL;
+            """)
+        return True, "Created webhook_outbox table"
+    except Exception as e:
+        return False, f"Could not create the webhook_outbox table - {e}"
+
+async def add_outbox_event(conn:asyncpg.Connection, endpoint:str, payload:dict, task_id:Optional[int] = None) -> int:
+    """
+    Queue `payload` for delivery to `endpoint` on `conn`, so it commits or rolls back
+    together with whatever else the caller's transaction writes. Events with the same
+    `task_id` are delivered one after the other, in the order they were queued.
+    """
+    event_id = await conn.fetchval("""
+        INSERT INTO webhook_outbox (endpoint, payload, task_id) VALUES ($1, $2, $3) RETURNING id;
+    """, endpoint, json.dumps(payload, default=str), task_id)
+    # Delivered to the dispatcher when the transaction commits
+    await conn.execute("SELECT pg_notify($1, $2);", outbox_channel, str(event_id))
+    return event_id
+
+async def enqueue_outbox_event(endpoint:str, payload:dict, task_id:Optional[int] = None):
+    """Queue a single event outside of any other write. Returns (True, event_id) or (False, error_message)."""
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                event_id = await add_outbox_event(conn, endpoint, payload, task_id)
+        return True, event_id
+    except Exception as e:
+        return False, f"Could not queue webhook event - {e}"
+
+async def claim_outbox_events(batch_size:int, lease_seconds:int = outbox_lease_seconds):
+    """
+    Take up to `batch_size` due events, oldest first. They stay pending but are hidden
+    for `lease_seconds`: if the dispatcher dies before acknowledging them they are
+    delivered again, which is what makes delivery at-least-once.
+    An event waits while an earlier event of its task is still out (retrying or claimed
+    by another dispatcher), so the events of a task never overtake each other.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("""
+            UPDATE webhook_outbox
+            SET available_at = NOW() + make_interval(secs => $2), attempts = attempts + 1
+            WHERE id IN (
+                SELECT id FROM webhook_outbox
+                WHERE status = 'pending' AND available_at <= NOW()
+                  AND NOT EXISTS (
+                      SELECT 1 FROM webhook_outbox earlier
+                      WHERE earlier.task_id = webhook_outbox.task_id AND earlier.status = 'pending'
+                        AND earlier.id < webhook_outbox.id AND earlier.available_at > NOW()
+                  )
+                ORDER BY id
+                LIMIT $1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, endpoint, payload, attempts, task_id;
+        """, batch_size, float(lease_seconds))
+    events = [dict(row) for row in rows]
+    for event in events:
+        event["payload"] = json.loads(event["payload"])
+    return sorted(events, key=lambda event: event["id"])
+
+async def mark_outbox_delivered(event_ids:list[int]):
+    if not event_ids:
+        return
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        await conn.execute("""
+            UPDATE webhook_outbox SET status = 'delivered', delivered_at = NOW(), last_error = NULL
+            WHERE id = ANY($1::bigint[]);
+        """, event_ids)
+
+async def release_outbox_events(event_ids:list[int]):
+    """Hand claimed events back undelivered, without counting the attempt."""
+    if not event_ids:
+        return
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        await conn.execute("""
+            UPDATE webhook_outbox SET available_at = NOW(), attempts = attempts - 1
+            WHERE id = ANY($1::bigint[]);
+        """, event_ids)
+
+async def mark_outbox_failed(event_id:int, attempts:int, error:str, max_attempts:int = outbox_max_attempts):
+    """Retry the event later with backoff, or give up on it after `max_attempts`."""
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        if attempts >= max_attempts:
+            await conn.execute("""
+                UPDATE webhook_outbox SET status = 'dead', last_error = $2 WHERE id = $1;
+            """, event_id, error)
+            return
+        delay = compute_retry_delay(attempts, base=outbox_retry_base, cap=outbox_retry_cap)
+        await conn.execute("""
+            UPDATE webhook_outbox SET available_at = NOW() + make_interval(secs => $2), last_error = $3 WHERE id = $1;
+        """, event_id, delay, error)
+
+async def seconds_until_next_outbox_event() -> Optional[float]:
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        return await conn.fetchval("""
+            SELECT GREATEST(EXTRACT(EPOCH FROM (min(available_at) - NOW())), 0)::float
+            FROM webhook_outbox WHERE status = 'pending';
+        """)
+
+async def get_outbox_stats():
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT status, count(*) AS count, EXTRACT(EPOCH FROM (NOW() - min(created_at)))::float AS oldest_seconds
+                FROM webhook_outbox
+                WHERE status <> 'delivered' OR delivered_at > NOW() - INTERVAL '1 day'
+                GROUP BY status;
+            """)
+        return True, {row["status"] : {"count" : row["count"], "oldest_seconds" : row["oldest_seconds"]} for row in rows}
+    except Exception as e:
+        return False, f"Could not get outbox stats - {e}"
+
+async def purge_delivered_outbox_events(older_than_days:int = outbox_keep_delivered_days):
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            result = await conn.execute("""
+                DELETE FROM webhook_outbox
+                WHERE status = 'delivered' AND delivered_at < NOW() - make_interval(days => $1);
+            """, older_than_days)
+        return True, f"Purged delivered webhook events - {result}"
+    except Exception as e:
+        return False, f"Could not purge delivered webhook events - {e}"
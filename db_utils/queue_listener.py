@@ -0,0 +1,85 @@
+import asyncpg
+import asyncio
+
+from db_utils.db_pool import create_listener_connection
+
+class QueueListener:
+    """
+    Holds one dedicated asyncpg connection that LISTENs on postgres channels
+    and fans every notification out to the asyncio queues subscribed to it.
+    """
+    def __init__(self):
+        self.conn: asyncpg.Connection | None = None
+        self.subscribers: dict[str, list[asyncio.Queue]] = {}
+        # Serializes connecting and subscribing, so a reconnect never races a LISTEN
+        self.lock = asyncio.Lock()
+
+    async def start(self):
+        async with self.lock:
+            await self._connect()
+
+    async def _connect(self):
+        """Open a new connection LISTENing on every subscribed channel, then replace the old one."""
+        conn = await create_listener_connection()
+        try:
+            for channel in self.subscribers:
+                await conn.add_listener(channel, self._on_notification)
+        except Exception:
+            await conn.close()
+            raise
+        old_conn, self.conn = self.conn, conn
+        if old_conn and not old_conn.is_closed():
+            await old_conn.close()
+
+    async def ensure_connected(self):
+        """Reconnect if the listener connection was dropped (e.g. postgres restart)."""
+        async with self.lock:
+            # Checked under the lock, a concurrent caller may have reconnected already
+            if self.conn is None or self.conn.is_closed():
+                print("Queue listener connection lost, reconnecting...")
+                await self._connect()
+
+    async def subscribe(self, channel: str) -> asyncio.Queue:
+        """
+        Return a queue that receives the payload of every NOTIFY on `channel`.
+        The LISTEN is in place when this returns, a failure to set it up raises.
+        """
+        queue = asyncio.Queue()
+        async with self.lock:
+            if channel not in self.subscribers:
+                # Only registered once the LISTEN succeeded, a failure leaves no trace
+                if self.conn and not self.conn.is_closed():
+                    await self.conn.add_listener(channel, self._on_notification)
+                self.subscribers[channel] = []
+            self.subscribers[channel].append(queue)
+        return queue
+
+    def unsubscribe(self, channel: str, queue: asyncio.Queue):
+        queues = self.subscribers.get(channel, [])
+        if queue in queues:
+            queues.remove(queue)
+
+    def _on_notification(self, connection, pid, channel, payload):
+        for queue in self.subscribers.get(channel, []):
+            queue.put_nowait(payload)
+
+    async def close(self):
+        async with self.lock:
+            if self.conn:
+                await self.conn.close()
+                self.conn = None
+
+
+async def wait_for_notification(queue: asyncio.Queue, timeout: float) -> bool:
+    """
+    Wait until something arrives on `queue` or `timeout` seconds pass.
+    Drains any burst of notifications so a single wake-up covers them all.
+    Returns True when woken by a notification, False on timeout.
+    """
+    try:
+        await asyncio.wait_for(queue.get(), timeout=timeout)
+    except asyncio.TimeoutError:
+        return False
+    while not queue.empty():
+        queue.get_nowait()
+    return True
@@ -1,9 +1,26 @@
 import asyncpg
 import asyncio
+import random
 import json
+import hashlib
 from asyncpg.utils import _quote_ident
 
 from db_utils.db_pool import get_pool,close_pool, init_pool
+from utils.constants import task_queue_channel, task_status_channel, task_cancel_channel, task_lease_seconds, default_max_attempts, retry_backoff_base, retry_backoff_cap, \
+    task_archive_after_days, task_archive_batch_size, default_task_aging_seconds, task_type_scheduling, queue_stats_window_hours, \
+    coalescing_task_types
+
+FINISHED_STATUSES = ["done", "failed", "dead", "timed_out", "cancelled", "aborted_via_restart"]
+
+# Uniqueness scope of a dedupe key among live tasks: coalescing types allow one pending and one
+# processing task per key, every other type a single live task. The index is named after a hash
+# of the scope, so changing coalescing_task_types builds a new one and drops the old at startup.
+DEDUPE_SCOPE = "(CASE WHEN task_type IN ({}) THEN status ELSE 'live' END)".format(
+    ", ".join(f"'{task_type}'" for task_type in coalescing_task_types)
+)
+DEDUPE_INDEX = f"idx_task_queue_dedupe_{hashlib.sha1(DEDUPE_SCOPE.encode()).hexdigest()[:10]}"
+# Tries of enqueue_task when the task it collided with finishes before it can be looked up
+ENQUEUE_ATTEMPTS = 3
 
 async def create_queue_table():
     try:
@@ -15,58 +32,481 @@ async def create_queue_table():
                 task_type TEXT NOT NULL,
                 payload JSONB,
                 priority INTEGER DEFAULT 0,
-                status TEXT DEFAULT 'pending', -- pending, processing, done, failed, aborted_via_restart
+                status TEXT DEFAULT 'pending', -- pending, processing, done, failed, dead, timed_out, cancelled, aborted_via_restart
                 created_at TIMESTAMP DEFAULT NOW(),
-                updated_at TIMESTAMP DEFAULT NOW()
+                updated_at TIMESTAMP DEFAULT NOW(),
+                worker_id TEXT,
+                lease_until TIMESTAMP,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL DEFAULT 3,
+                run_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                dedupe_key TEXT,
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP,
+                result JSONB,
+                error JSONB,
+                messages JSONB NOT NULL DEFAULT '[]'::jsonb
             );
         """)
+            # Tables created before leases / retries were introduced
+            await conn.execute("""
+                ALTER TABLE task_queue ADD COLUMN IF NOT EXISTS worker_id TEXT;
+                ALTER TABLE task_queue ADD COLUMN IF NOT EXISTS lease_until TIMESTAMP;
+                ALTER TABLE task_queue ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+                ALTER TABLE task_queue ADD COLUMN IF NOT EXISTS max_attempts INTEGER NOT NULL DEFAULT 3;
+                ALTER TABLE task_queue ADD COLUMN IF NOT EXISTS run_at TIMESTAMP NOT NULL DEFAULT NOW();
+                ALTER TABLE task_queue ADD COLUMN IF NOT EXISTS dedupe_key TEXT;
+                ALTER TABLE task_queue ADD COLUMN IF NOT EXISTS started_at TIMESTAMP;
+                ALTER TABLE task_queue ADD COLUMN IF NOT EXISTS finished_at TIMESTAMP;
+                ALTER TABLE task_queue ADD COLUMN IF NOT EXISTS result JSONB;
+                ALTER TABLE task_queue ADD COLUMN IF NOT EXISTS error JSONB;
+                ALTER TABLE task_queue ADD COLUMN IF NOT EXISTS messages JSONB NOT NULL DEFAULT '[]'::jsonb;
+                ALTER TABLE task_queue ADD COLUMN IF NOT EXISTS cancel_requested BOOLEAN NOT NULL DEFAULT FALSE;
+            """)
+            # Push every status change / new status message to listeners of the status channel
+            await conn.execute(f"""
+                CREATE OR REPLACE FUNCTION notify_task_status() RETURNS trigger AS $$
+                BEGIN
+                    IF TG_OP = 'INSERT' OR NEW.status IS DISTINCT FROM OLD.status OR NEW.messages IS DISTINCT FROM OLD.messages THEN
+                        PERFORM pg_notify('{task_status_channel}', json_build_object('id', NEW.id, 'task_type', NEW.task_type, 'status', NEW.status)::text);
+                    END IF;
+                    RETURN NEW;
+                END;
+                $$ LANGUAGE plpgsql;
+                DROP TRIGGER IF EXISTS task_queue_status_notify ON task_queue;
+                CREATE TRIGGER task_queue_status_notify
+                AFTER INSERT OR UPDATE ON task_queue
+                FOR EACH ROW EXECUTE FUNCTION notify_task_status();
+            """)
+            # At most one live (pending/processing) task per dedupe key, see DEDUPE_SCOPE
+            await conn.execute(f"""
+                CREATE UNIQUE INDEX IF NOT EXISTS {DEDUPE_INDEX}
+                ON task_queue (dedupe_key, {DEDUPE_SCOPE}) WHERE status IN ('pending', 'processing');
+            """)
+            # Dedupe indexes of an earlier scope, dropped once the current one is in place
+            stale_indexes = await conn.fetch("""
+                SELECT indexname FROM pg_indexes
+                WHERE tablename = 'task_queue' AND indexname LIKE 'idx\\_task\\_queue\\_dedupe%' AND indexname <> $1;
+            """, DEDUPE_INDEX)
+            for row in stale_indexes:
+                await conn.execute(f"DROP INDEX IF EXISTS {_quote_ident(row['indexname'])};")
+            # Only pending rows are ever claimed, so keep finished history out of the claim index.
+            # The claim sorts by an aged priority, so the index serves its type / due-time filter
             await conn.execute("""
-                CREATE INDEX IF NOT EXISTS idx_task_queue_priority
-                ON task_queue (priority DESC, created_at ASC);
+                DROP INDEX IF EXISTS idx_task_queue_priority;
+                DROP INDEX IF EXISTS idx_task_queue_pending;
+                CREATE INDEX IF NOT EXISTS idx_task_queue_pending_due
+                ON task_queue (task_type, run_at) WHERE status = 'pending';
+                CREATE INDEX IF NOT EXISTS idx_task_queue_finished
+                ON task_queue (updated_at) WHERE status NOT IN ('pending', 'processing');
             """)
         return True, "Created task_queue table"
     except Exception as e:
         return False, f"Could not create the task_queue table - {e}"
     
-async def enqueue_task(task_type:str, payload=None, priority:int=0):
+async def create_queue_history_table():
     try:
-        print(f" from db : Enqueueing task: {task_type} with payload: {payload} and priority: {priority}")
         pool = await get_pool()
         async with pool.acquire() as conn:
             await conn.execute("""
-                INSERT INTO task_queue (task_type, payload, priority)
-                VALUES ($1, $2, $3);
-            """, task_type, payload, priority)
-        return True, "Task enqueued successfully"
+                CREATE TABLE IF NOT EXISTS task_queue_history (
+                    id INTEGER NOT NULL,
+                    task_type TEXT NOT NULL,
+                    status TEXT,
+                    created_at TIMESTAMP,
+                    updated_at TIMESTAMP NOT NULL,
+                    archived_at TIMESTAMP DEFAULT NOW(),
+                    task JSONB NOT NULL -- the full task_queue row
+                ) PARTITION BY RANGE (updated_at);
+            """)
+            await conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_task_queue_history_id ON task_queue_history (id);
+            """)
+        return True, "Created task_queue_history table"
+    except Exception as e:
+        return False, f"Could not create the task_queue_history table - {e}"
+    
+async def archive_finished_tasks(older_than_days:int = task_archive_after_days, batch_size:int = task_archive_batch_size):
+    """
+    Move finished tasks last updated more than `older_than_days` ago into the
+    monthly partitions of task_queue_history, `batch_size` rows per transaction.
+    Returns (True, message) or (False, error_message).
+    """
+    try:
+        pool = await get_pool()
+        archived = 0
+        async with pool.acquire() as conn:
+            months = await conn.fetch("""
+                SELECT DISTINCT date_trunc('month', updated_at) AS month FROM task_queue
+                WHERE status = ANY($1::text[]) AND updated_at < NOW() - make_interval(days => $2)
+            """, FINISHED_STATUSES, older_than_days)
+            for row in months:
+                month = row["month"]
+                partition = _quote_ident(f"task_queue_history_{month:%Y_%m}")
+                await conn.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {partition} PARTITION OF task_queue_history
+                    FOR VALUES FROM ('{month:%Y-%m-01}') TO ('{month:%Y-%m-01}'::timestamp + INTERVAL '1 month');
+                """)
+            while True:
+                async with conn.transaction():
+                    result = await conn.execute("""
+                        WITH moved AS (
+                            DELETE FROM task_queue
+                            WHERE id IN (
+                                SELECT id FROM task_queue
+                                WHERE status = ANY($1::text[]) AND updated_at < NOW() - make_interval(days => $2)
+                                LIMIT $3
+                                FOR UPDATE SKIP LOCKED
+                            )
+                            RETURNING *
+                        )
+                        INSERT INTO task_queue_history (id, task_type, status, created_at, updated_at, task)
+                        SELECT id, task_type, status, created_at, updated_at, to_jsonb(moved) FROM moved
+                    """, FINISHED_STATUSES, older_than_days, batch_size)
+                moved = int(result.split()[-1])
+                archived += moved
+                if moved < batch_size:
+                    break
+        return True, f"Archived {archived} finished tasks"
+    except Exception as e:
+        return False, f"Could not archive tasks - {e}"
+    
+def default_dedupe_key(task_type:str, payload=None):
+    """
+    Dedupe key used when the caller does not pass one.
+    Coalescing types (check_for_jobs, apply_batch) share one key per type, so there is at most
+    one pending run of them besides the running one. Job tasks dedupe on their job_url.
+    """
+    if task_type in coalescing_task_types:
+        return task_type
+    try:
+        payload_dict = json.loads(payload) if isinstance(payload, str) else (payload or {})
+        job_url = payload_dict.get("job_url")
+    except (ValueError, AttributeError):
+        job_url = None
+    if job_url:
+        return f"{task_type}:{job_url}"
+    return None
+
+async def enqueue_task(task_type:str, payload=None, priority:int=0, max_attempts:int=default_max_attempts, dedupe_key:str=None):
+    """
+    Insert a task unless a live task with the same dedupe key already exists.
+    Returns (True, {"status": "Enqueued" | "Exists", "task_id": id, ...}) or (False, error_message).
+    """
+    try:
+        print(f" from db : Enqueueing task: {task_type} with payload: {payload} and priority: {priority}")
+        dedupe_key = dedupe_key or default_dedupe_key(task_type, payload)
+        pool = await get_pool()
+        for _ in range(ENQUEUE_ATTEMPTS):
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    task_id = await conn.fetchval(f"""
+                        INSERT INTO task_queue (task_type, payload, priority, max_attempts, dedupe_key)
+                        VALUES ($1, $2, $3, $4, $5)
+                        ON CONFLICT (dedupe_key, {DEDUPE_SCOPE}) WHERE status IN ('pending', 'processing') DO NOTHING
+                        RETURNING id;
+                    """, task_type, payload, priority, max_attempts, dedupe_key)
+                    if task_id is not None:
+                        # Delivered to listeners when the transaction commits
+                        await conn.execute("SELECT pg_notify($1, $2);", task_queue_channel, task_type)
+                        return True, {"status" : "Enqueued", "task_id" : task_id, "message" : "Task enqueued successfully"}
+                    # A coalescing type can have a running task besides the pending one it merged into
+                    existing_id = await conn.fetchval("""
+                        SELECT id FROM task_queue
+                        WHERE dedupe_key = $1 AND status IN ('pending', 'processing')
+                        ORDER BY status = 'pending' DESC
+                        LIMIT 1;
+                    """, dedupe_key)
+            if existing_id is not None:
+                return True, {"status" : "Exists", "task_id" : existing_id, "message" : f"Task already queued as {existing_id}"}
+            # The duplicate finished between the insert and the lookup, try again
+        return False, f"Could not enqueue task - the task with dedupe key {dedupe_key} kept changing, gave up after {ENQUEUE_ATTEMPTS} attempts"
     except Exception as e:
         return False, f"Could not enqueue task - {e}"
         
-async def get_next_task():
+async def enqueue_tasks(tasks:list[dict]):
+    """
+    Insert many tasks with a single multi-row INSERT in one transaction.
+    Each task is a dict with task_type and optional payload (dict), priority, max_attempts and dedupe_key.
+    Ids are pre-allocated from the sequence so the result lines up with `tasks`:
+    Returns (True, [{"status": "Enqueued" | "Exists", "task_id": id}, ...]) or (False, error_message).
+    """
     try:
+        task_types, payloads, priorities, max_attempts, dedupe_keys = [], [], [], [], []
+        for task in tasks:
+            payload = task.get("payload")
+            payload = json.dumps(payload) if payload is not None and not isinstance(payload, str) else payload
+            task_types.append(task["task_type"])
+            payloads.append(payload)
+            priorities.append(task.get("priority") or 0)
+            max_attempts.append(task.get("max_attempts") or default_max_attempts)
+            dedupe_keys.append(task.get("dedupe_key") or default_dedupe_key(task["task_type"], payload))
         pool = await get_pool()
         async with pool.acquire() as conn:
             async with conn.transaction():
-                row = await conn.fetchrow(
-                    """
-                    SELECT * FROM task_queue
-                    WHERE status = 'pending'
-                    ORDER BY priority DESC, created_at ASC
+                ids = await conn.fetch(
+                    "SELECT nextval(pg_get_serial_sequence('task_queue', 'id')) AS id FROM generate_series(1, $1)",
+                    len(tasks)
+                )
+                ids = [row["id"] for row in ids]
+                inserted = await conn.fetch(f"""
+                    INSERT INTO task_queue (id, task_type, payload, priority, max_attempts, dedupe_key)
+                    SELECT * FROM unnest($1::int[], $2::text[], $3::jsonb[], $4::int[], $5::int[], $6::text[])
+                    ON CONFLICT (dedupe_key, {DEDUPE_SCOPE}) WHERE status IN ('pending', 'processing') DO NOTHING
+                    RETURNING id, task_type;
+                """, ids, task_types, payloads, priorities, max_attempts, dedupe_keys)
+                inserted_ids = {row["id"] for row in inserted}
+                skipped_keys = [key for task_id, key in zip(ids, dedupe_keys) if task_id not in inserted_ids]
+                existing = await conn.fetch("""
+                    SELECT id, dedupe_key FROM task_queue
+                    WHERE dedupe_key = ANY($1::text[]) AND status IN ('pending', 'processing')
+                    ORDER BY status = 'pending';
+                """, skipped_keys) if skipped_keys else []
+                # Pending rows come last and win, they are the ones the new tasks merged into
+                existing_ids = {row["dedupe_key"] : row["id"] for row in existing}
+                for task_type in {row["task_type"] for row in inserted}:
+                    await conn.execute("SELECT pg_notify($1, $2);", task_queue_channel, task_type)
+        results = []
+        for task_id, key in zip(ids, dedupe_keys):
+            if task_id in inserted_ids:
+                results.append({"status" : "Enqueued", "task_id" : task_id})
+            else:
+                results.append({"status" : "Exists", "task_id" : existing_ids.get(key)})
+        return True, results
+    except Exception as e:
+        return False, f"Could not enqueue tasks - {e}"
+        
+async def get_next_task(worker_id:str, task_types:list[str] = None, lease_seconds:int = task_lease_seconds):
+    """
+    Atomically claim the next pending task for `worker_id`, optionally restricted to `task_types`.
+    `task_types` is also a preference order: the first type in it with a due task wins
+    (the worker's fair-share scheduler decides that order). Within a type, tasks are
+    ordered by their effective priority, which grows the longer they have been waiting.
+    The row is marked 'processing' with a lease that the worker has to keep
+    extending through heartbeats, otherwise the reaper puts it back in the queue.
+    """
+    try:
+        aging_types = list(task_type_scheduling.keys())
+        aging_seconds = [float(task_type_scheduling[task_type].get("aging_seconds", default_task_aging_seconds)) for task_type in aging_types]
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            row = await conn.fetchrow(
+                """
+                UPDATE task_queue
+                SET status = 'processing',
+                    worker_id = $1,
+                    lease_until = NOW() + make_interval(secs => $2),
+                    attempts = attempts + 1,
+                    started_at = COALESCE(started_at, NOW()),
+                    updated_at = NOW()
+                WHERE id = (
+                    SELECT task_queue.id FROM task_queue
+                    LEFT JOIN unnest($4::text[], $5::float[]) AS aging(task_type, seconds) USING (task_type)
+                    WHERE task_queue.status = 'pending'
+                      AND task_queue.run_at <= NOW()
+                      AND ($3::text[] IS NULL OR task_queue.task_type = ANY($3::text[]))
+                      AND NOT task_queue.cancel_requested
+                      -- The follow-up of a coalescing task waits until the running one is finished
+                      AND NOT EXISTS (
+                          SELECT 1 FROM task_queue running
+                          WHERE running.dedupe_key = task_queue.dedupe_key AND running.status = 'processing'
+                      )
+                    ORDER BY array_position($3::text[], task_queue.task_type),
+                             task_queue.priority + EXTRACT(EPOCH FROM NOW() - task_queue.run_at) / COALESCE(aging.seconds, $6) DESC,
+                             task_queue.created_at ASC
                     LIMIT 1
+                    FOR UPDATE OF task_queue SKIP LOCKED
+                )
+                RETURNING *
+                """,
+                worker_id, lease_seconds, task_types, aging_types, aging_seconds, float(default_task_aging_seconds)
+            )
+            if row:
+                return True, dict(row)
+            else:
+                return False, "No pending tasks"
+    except Exception as e:
+        return False, f"Could not get task - {e}"
+    
+async def claim_tasks(worker_id:str, task_type:str, limit:int, lease_seconds:int = task_lease_seconds):
+    """
+    Claim up to `limit` due tasks of `task_type` at once, for a handler that works through
+    several tasks in one session. They are ordered like get_next_task would hand them out
+    and leased to `worker_id` the same way, see extend_task_leases.
+    Returns (True, [task, ...]) or (False, error_message).
+    """
+    try:
+        aging_seconds = float(task_type_scheduling.get(task_type, {}).get("aging_seconds", default_task_aging_seconds))
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                UPDATE task_queue
+                SET status = 'processing',
+                    worker_id = $1,
+                    lease_until = NOW() + make_interval(secs => $2),
+                    attempts = attempts + 1,
+                    started_at = COALESCE(started_at, NOW()),
+                    updated_at = NOW()
+                WHERE id IN (
+                    SELECT id FROM task_queue
+                    WHERE status = 'pending' AND run_at <= NOW() AND task_type = $3 AND NOT cancel_requested
+                    ORDER BY priority + EXTRACT(EPOCH FROM NOW() - run_at) / $5 DESC, created_at ASC
+                    LIMIT $4
                     FOR UPDATE SKIP LOCKED
+                )
+                RETURNING *
+                """,
+                worker_id, lease_seconds, task_type, limit, aging_seconds
+            )
+        return True, sorted((dict(row) for row in rows), key=lambda task: (-(task["priority"] or 0), task["created_at"]))
+    except Exception as e:
+        return False, f"Could not claim tasks - {e}"
+
+async def get_queue_stats(window_hours:int = queue_stats_window_hours):
+    """
+    Per task type: queue wait percentiles (first claim - enqueue) over the last
+    `window_hours`, plus how many tasks are pending right now and the oldest wait.
+    """
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                WITH waits AS (
+                    SELECT task_type,
+                           COUNT(*) AS started,
+                           percentile_cont(ARRAY[0.5, 0.9, 0.99]) WITHIN GROUP (
+                               ORDER BY EXTRACT(EPOCH FROM started_at - created_at)
+                           ) AS wait_percentiles
+                    FROM task_queue
+                    WHERE started_at > NOW() - make_interval(hours => $1)
+                    GROUP BY task_type
+                ),
+                backlog AS (
+                    SELECT task_type,
+                           COUNT(*) AS pending,
+                           EXTRACT(EPOCH FROM NOW() - MIN(run_at)) FILTER (WHERE run_at <= NOW()) AS oldest_wait
+                    FROM task_queue
+                    WHERE status = 'pending'
+                    GROUP BY task_type
+                )
+                SELECT COALESCE(waits.task_type, backlog.task_type) AS task_type,
+                       COALESCE(waits.started, 0) AS started,
+                       waits.wait_percentiles,
+                       COALESCE(backlog.pending, 0) AS pending,
+                       backlog.oldest_wait
+                FROM waits FULL OUTER JOIN backlog ON waits.task_type = backlog.task_type
+                ORDER BY 1
+                """,
+                window_hours
+            )
+        stats = {}
+        for row in rows:
+            percentiles = row["wait_percentiles"] or [None, None, None]
+            stats[row["task_type"]] = {
+                "started" : row["started"],
+                "wait_p50" : percentiles[0],
+                "wait_p90" : percentiles[1],
+                "wait_p99" : percentiles[2],
+                "pending" : row["pending"],
+                "oldest_pending_wait" : float(row["oldest_wait"]) if row["oldest_wait"] is not None else None,
+            }
+        return True, stats
+    except Exception as e:
+        return False, f"Could not get queue stats - {e}"
+    
+async def extend_task_lease(task_id:int, worker_id:str, lease_seconds:int = task_lease_seconds):
+    """
+    Heartbeat for a claimed task. Returns (False, message) when the lease
+    is no longer held by `worker_id` (it expired and was requeued or finished).
+    """
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            result = await conn.execute(
+                """
+                UPDATE task_queue
+                SET lease_until = NOW() + make_interval(secs => $3), updated_at = NOW()
+                WHERE id = $1 AND worker_id = $2 AND status = 'processing'
+                """,
+                task_id, worker_id, lease_seconds
+            )
+        if result.split()[-1] == "0":
+            return False, f"Lease on task {task_id} lost"
+        return True, "Lease extended"
+    except Exception as e:
+        return False, f"Could not extend lease - {e}"
+    
+async def extend_task_leases(task_ids:list[int], worker_id:str, lease_seconds:int = task_lease_seconds):
+    """
+    Heartbeat for claimed tasks. Returns (True, {task_id: cancel_requested}) for the tasks
+    still held, or (False, error_message). A task whose cancellation was requested keeps
+    its lease, so the worker can stop it and record it as cancelled.
+    """
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                UPDATE task_queue
+                SET lease_until = NOW() + make_interval(secs => $3), updated_at = NOW()
+                WHERE id = ANY($1::int[]) AND worker_id = $2 AND status = 'processing'
+                RETURNING id, cancel_requested
+                """,
+                task_ids, worker_id, lease_seconds
+            )
+        return True, {row["id"] : row["cancel_requested"] for row in rows}
+    except Exception as e:
+        return False, f"Could not extend leases - {e}"
+    
+async def requeue_expired_tasks():
+    """
+    Put 'processing' tasks whose lease ran out (crashed or restarted worker)
+    back in the queue. Returns (True, message) or (False, error_message).
+    """
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                rows = await conn.fetch(
+                    """
+                    WITH expired AS (
+                        SELECT id,
+                            CASE
+                                WHEN cancel_requested THEN 'cancelled'
+                                WHEN attempts >= max_attempts THEN 'dead'
+                                -- A coalescing task already has a pending follow-up that will do its work
+                                WHEN EXISTS (
+                                    SELECT 1 FROM task_queue pending_task
+                                    WHERE pending_task.dedupe_key = task_queue.dedupe_key AND pending_task.status = 'pending'
+                                ) THEN 'cancelled'
+                                ELSE 'pending'
+                            END AS next_status
+                        FROM task_queue
+                        WHERE status = 'processing' AND (lease_until IS NULL OR lease_until < NOW())
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    UPDATE task_queue
+                    SET status = expired.next_status,
+                        finished_at = CASE WHEN expired.next_status <> 'pending' THEN NOW() END,
+                        error = jsonb_build_object('status', 'Failed', 'message', 'Worker lease expired'),
+                        worker_id = NULL, lease_until = NULL, updated_at = NOW()
+                    FROM expired
+                    WHERE task_queue.id = expired.id
+                    RETURNING task_queue.id, task_queue.task_type, task_queue.status
                     """
                 )
-                if row:
-                    return True, dict(row)
-                else:
-                    return False, "No pending tasks"
+                requeued = [row for row in rows if row["status"] == "pending"]
+                for task_type in {row["task_type"] for row in requeued}:
+                    await conn.execute("SELECT pg_notify($1, $2);", task_queue_channel, task_type)
+        return True, f"Requeued {len(requeued)} tasks with expired leases, {len(rows) - len(requeued)} moved to dead or superseded"
     except Exception as e:
-        return False, f"Could not get task - {e}"
+        return False, f"Could not requeue expired tasks - {e}"
     
 async def main():
     await init_pool()
-    success, message = await get_next_task()
     await view_queue_table(5)
-    print(message)
     await close_pool()
     
 async def view_queue_table(num_rows: int = 10):
@@ -81,42 +521,198 @@ async def view_queue_table(num_rows: int = 10):
         for row in rows:
             print(dict(row))
             
-async def update_task_status(task_id:int, status:str):
+async def update_task_status(task_id:int, status:str, result:dict = None, worker_id:str = None):
+    """
+    Set the status of a task, stamping finished_at and storing `result` when it is a final status.
+    With `worker_id` the row is only updated while that worker still holds it, so a worker whose
+    lease expired cannot overwrite the task after it was requeued or claimed by someone else.
+    """
     try:
         pool = await get_pool()
         async with pool.acquire() as conn:
-            await conn.execute(
-                "UPDATE task_queue SET status = $1, updated_at = NOW() WHERE id = $2",
-                status, task_id
+            result = await conn.execute(
+                """
+                UPDATE task_queue
+                SET status = $1, lease_until = NULL, updated_at = NOW(),
+                    finished_at = CASE WHEN $1 = ANY($3::text[]) THEN NOW() ELSE finished_at END,
+                    result = COALESCE($4::jsonb, result)
+                WHERE id = $2 AND ($5::text IS NULL OR (worker_id = $5 AND status = 'processing'))
+                """,
+                status, task_id, FINISHED_STATUSES, json.dumps(result) if result is not None else None, worker_id
             )
+        if result.split()[-1] == "0":
+            print(f"Task {task_id} not updated to '{status}', it is no longer held by {worker_id}")
+            return False, f"Task {task_id} is no longer held by {worker_id}"
         return True, "Task status updated successfully"
     except Exception as e:
         return False, f"Could not update task status - {e}"
     
-async def abort_tasks_on_restart(task_type: str = "check_for_jobs"):
+async def add_task_message(task_id:int, status:str, message:str):
+    """Append a session status message to the task's message log."""
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            await conn.execute(
+                """
+                UPDATE task_queue
+                SET messages = messages || jsonb_build_array(jsonb_build_object('status', $2::text, 'message', $3::text, 'at', NOW()))
+                WHERE id = $1
+                """,
+                task_id, status, message
+            )
+        return True, "Task message added"
+    except Exception as e:
+        return False, f"Could not add task message - {e}"
+    
+async def get_task(task_id:int):
+    """
+    Retrieve a task by id, from task_queue or, once archived, from task_queue_history.
+    Returns the task as a dict, or None if not found.
     """
-    Mark pending/processing tasks of the given task_type as 'aborted via restart'.
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            row = await conn.fetchrow("SELECT * FROM task_queue WHERE id = $1", task_id)
+            if row:
+                task = dict(row)
+                for column in ("payload", "result", "error", "messages"):
+                    if isinstance(task.get(column), str):
+                        task[column] = json.loads(task[column])
+                return task
+            archived = await conn.fetchval("SELECT task FROM task_queue_history WHERE id = $1", task_id)
+            return json.loads(archived) if archived else None
+    except Exception as e:
+        print(f"Could not retrieve task - {e}")
+        return None
+    
+async def cancel_task(task_id:int):
+    """
+    Cancel a task. A pending task is cancelled right away. For a processing one the request
+    is recorded on the row and the worker running it is asked to stop through a NOTIFY on the
+    cancel channel. A worker that missed the NOTIFY sees the request on its next heartbeat,
+    and a task that fails or whose lease runs out is finalized as cancelled instead of retried.
     Returns (True, message) or (False, error_message).
     """
     try:
         pool = await get_pool()
         async with pool.acquire() as conn:
-            result = await conn.execute(
+            async with conn.transaction():
+                status = await conn.fetchval("SELECT status FROM task_queue WHERE id = $1 FOR UPDATE", task_id)
+                if status is None:
+                    return False, f"Task {task_id} not found"
+                if status == "pending":
+                    await conn.execute(
+                        "UPDATE task_queue SET status = 'cancelled', finished_at = NOW(), updated_at = NOW() WHERE id = $1",
+                        task_id
+                    )
+                    return True, f"Task {task_id} cancelled"
+                if status == "processing":
+                    await conn.execute("UPDATE task_queue SET cancel_requested = TRUE, updated_at = NOW() WHERE id = $1", task_id)
+                    await conn.execute("SELECT pg_notify($1, $2);", task_cancel_channel, str(task_id))
+                    return True, f"Cancellation of running task {task_id} requested"
+                return False, f"Task {task_id} is already {status}"
+    except Exception as e:
+        return False, f"Could not cancel task - {e}"
+    
+def compute_retry_delay(attempt:int, base:float = retry_backoff_base, cap:float = retry_backoff_cap) -> float:
+    """Exponential backoff with equal jitter, so failed tasks do not retry in lockstep."""
+    delay = min(cap, base * 2 ** max(attempt - 1, 0))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+async def fail_task(task_id:int, retry:bool = True, error:dict = None, worker_id:str = None):
+    """
+    Record a failed attempt of `task_id`, storing `error` on the row.
+    If it has attempts left (and `retry` is set) it goes back to 'pending' with
+    run_at pushed out by a jittered exponential backoff, otherwise it moves to 'dead'.
+    A task whose cancellation was requested (see cancel_task) moves to 'cancelled' instead.
+    With `worker_id` nothing changes unless that worker still holds the task (see update_task_status).
+    Returns (True, new_status) or (False, error_message).
+    """
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                row = await conn.fetchrow(
+                    "SELECT attempts, max_attempts, status, worker_id, dedupe_key, cancel_requested FROM task_queue WHERE id = $1 FOR UPDATE",
+                    task_id
+                )
+                if not row:
+                    return False, f"Task {task_id} not found"
+                if worker_id is not None and (row["worker_id"] != worker_id or row["status"] != "processing"):
+                    print(f"Task {task_id} not failed, it is no longer held by {worker_id}")
+                    return False, f"Task {task_id} is no longer held by {worker_id}"
+                if row["cancel_requested"]:
+                    await conn.execute(
+                        """
+                        UPDATE task_queue
+                        SET status = 'cancelled', error = $2::jsonb, finished_at = NOW(),
+                            worker_id = NULL, lease_until = NULL, updated_at = NOW()
+                        WHERE id = $1
+                        """,
+                        task_id, json.dumps(error) if error is not None else None
+                    )
+                    print(f"Task {task_id} failed after its cancellation was requested, moved to cancelled")
+                    return True, "cancelled"
+                if retry and row["dedupe_key"] is not None and await conn.fetchval(
+                    "SELECT EXISTS (SELECT 1 FROM task_queue WHERE dedupe_key = $1 AND status = 'pending' AND id <> $2)",
+                    row["dedupe_key"], task_id
+                ):
+                    # A coalescing task with a pending follow-up, which does the retry's work
+                    await conn.execute(
+                        """
+                        UPDATE task_queue
+                        SET status = 'cancelled', error = $2::jsonb, finished_at = NOW(),
+                            worker_id = NULL, lease_until = NULL, updated_at = NOW()
+                        WHERE id = $1
+                        """,
+                        task_id, json.dumps(error) if error is not None else None
+                    )
+                    print(f"Task {task_id} failed, not retried as a pending task with the same dedupe key supersedes it")
+                    return True, "cancelled"
+                if retry and row["attempts"] < row["max_attempts"]:
+                    delay = compute_retry_delay(row["attempts"])
+                    await conn.execute(
+                        """
+                        UPDATE task_queue
+                        SET status = 'pending', run_at = NOW() + make_interval(secs => $2),
+                            error = $3::jsonb, worker_id = NULL, lease_until = NULL, updated_at = NOW()
+                        WHERE id = $1
+                        """,
+                        task_id, delay, json.dumps(error) if error is not None else None
+                    )
+                    print(f"Task {task_id} failed (attempt {row['attempts']}/{row['max_attempts']}), retrying in {delay:.0f}s")
+                    return True, "pending"
+                await conn.execute(
+                    """
+                    UPDATE task_queue
+                    SET status = 'dead', error = $2::jsonb, finished_at = NOW(),
+                        worker_id = NULL, lease_until = NULL, updated_at = NOW()
+                    WHERE id = $1
+                    """,
+                    task_id, json.dumps(error) if error is not None else None
+                )
+                print(f"Task {task_id} failed after {row['attempts']} attempts, moved to dead")
+                return True, "dead"
+    except Exception as e:
+        return False, f"Could not fail task - {e}"
+    
+async def seconds_until_next_due_task(task_types:list[str] = None):
+    """Seconds until the earliest delayed pending task becomes claimable, or None if there is none."""
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            return await conn.fetchval(
                 """
-                UPDATE task_queue
-                SET status = 'aborted_via_restart', updated_at = NOW()
-                WHERE task_type = $1 AND status IN ('pending', 'processing');
+                SELECT EXTRACT(EPOCH FROM MIN(run_at) - NOW())::float
+                FROM task_queue
+                WHERE status = 'pending' AND run_at > NOW()
+                  AND ($1::text[] IS NULL OR task_type = ANY($1::text[]))
                 """,
-                task_type
+                task_types
             )
-            # result is like "UPDATE <n>"
-            try:
-                affected = int(result.split()[-1])
-            except Exception:
-                affected = 0
-        return True, f"Marked {affected} '{task_type}' tasks as aborted via restart"
-    except Exception as e:
-        return False, f"Could not mark tasks as aborted - {e}"
+    except Exception as e:
+        print(f"Could not get next due task - {e}")
+        return None
     
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,79 @@
+import math
+import hashlib
+from typing import Iterable, Optional
+
+from db_utils.access_db import count_jobs, iter_job_uuids, get_existing_job_uuids
+from utils.constants import seen_index_bloom_threshold, seen_index_false_positive_rate
+
+class BloomFilter:
+    """Fixed size Bloom filter over integer job uuids."""
+    def __init__(self, capacity:int, false_positive_rate:float = seen_index_false_positive_rate):
+        capacity = max(capacity, 1)
+        self.num_bits = max(8, int(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, uuid:int):
+        digest = hashlib.blake2b(str(uuid).encode(), digest_size=16).digest()
+        # Double hashing: k positions out of two 64 bit hashes
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, uuid:int):
+        for position in self._positions(uuid):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, uuid:int) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(uuid))
+
+
+class SeenJobIndex:
+    """
+    uuids of the jobs already in the jobs table, so the scraper can skip their tiles
+    without opening the job page.
+    Kept as a plain set, or as a Bloom filter once the table holds more than
+    `bloom_threshold` jobs. Bloom filter hits are confirmed against the jobs table,
+    a false positive must never hide a new job.
+    """
+    def __init__(self, bloom_threshold:int = seen_index_bloom_threshold):
+        self.bloom_threshold = bloom_threshold
+        self.uuids: Optional[set[int]] = set()
+        self.bloom: Optional[BloomFilter] = None
+        self.size = 0
+
+    @classmethod
+    async def from_jobs_table(cls, bloom_threshold:int = seen_index_bloom_threshold) -> "SeenJobIndex":
+        index = cls(bloom_threshold)
+        total = await count_jobs()
+        if total > bloom_threshold:
+            # Room to grow until the next restart rebuilds it
+            index.bloom = BloomFilter(capacity=total * 2)
+            index.uuids = None
+        async for uuids in iter_job_uuids():
+            index.add_many(uuids)
+        print(f"Seen job index warmed with {index.size} jobs ({'bloom filter' if index.bloom else 'set'})")
+        return index
+
+    def add(self, uuid:Optional[int]):
+        if uuid is None:
+            return
+        if self.bloom:
+            self.bloom.add(uuid)
+        else:
+            self.uuids.add(uuid)
+        self.size += 1
+
+    def add_many(self, uuids:Iterable[int]):
+        for uuid in uuids:
+            self.add(uuid)
+
+    def __len__(self) -> int:
+        return len(self.uuids) if self.uuids is not None else self.size
+
+    async def known(self, uuids:list[int]) -> set[int]:
+        """The subset of `uuids` already ingested."""
+        uuids = [uuid for uuid in uuids if uuid is not None]
+        if self.bloom is None:
+            return {uuid for uuid in uuids if uuid in self.uuids}
+        candidates = [uuid for uuid in uuids if uuid in self.bloom]
+        return await get_existing_job_uuids(candidates) if candidates else set()
@@ -0,0 +1,62 @@
+from datetime import datetime
+from typing import Optional
+
+from db_utils.db_pool import get_pool
+from utils.constants import watermark_keep_uuids
+
+async def create_watermarks_table():
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS scrape_watermarks (
+                    category TEXT PRIMARY KEY,
+                    recent_uuids BIGINT[] NOT NULL DEFAULT '{}', -- newest first
+                    posted_at TIMESTAMPTZ, -- when the newest job seen in the category was posted
+                    updated_at TIMESTAMP DEFAULT NOW()
+                );
+            """)
+        return True, "Created scrape_watermarks table"
+    except Exception as e:
+        return False, f"Could not create the scrape_watermarks table - {e}"
+
+async def get_watermarks() -> dict[str, dict]:
+    """{category: {"recent_uuids": [...], "posted_at": datetime | None}} for every scraped category."""
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch("SELECT category, recent_uuids, posted_at FROM scrape_watermarks;")
+        return {row["category"] : {"recent_uuids" : list(row["recent_uuids"]), "posted_at" : row["posted_at"]} for row in rows}
+    except Exception as e:
+        print(f"Could not load scrape watermarks - {e}")
+        return {}
+
+async def update_watermark(category:str, uuids:list[int], posted_at:Optional[datetime], keep:int = watermark_keep_uuids):
+    """
+    Merge the uuids just seen at the top of a category (newest first) in front of the
+    stored ones, keep the `keep` newest, and move posted_at forward. One statement,
+    so the watermark is either fully updated or not at all.
+    """
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            await conn.execute("""
+                INSERT INTO scrape_watermarks (category, recent_uuids, posted_at, updated_at)
+                VALUES ($1, $2::bigint[], $3, NOW())
+                ON CONFLICT (category) DO UPDATE SET
+                    recent_uuids = COALESCE((
+                        SELECT array_agg(uuid ORDER BY first_position)
+                        FROM (
+                            SELECT uuid, min(position) AS first_position
+                            FROM unnest(EXCLUDED.recent_uuids || scrape_watermarks.recent_uuids) WITH ORDINALITY AS merged(uuid, position)
+                            GROUP BY uuid
+                            ORDER BY first_position
+                            LIMIT $4
+                        ) newest
+                    ), '{}'),
+                    posted_at = GREATEST(scrape_watermarks.posted_at, EXCLUDED.posted_at),
+                    updated_at = NOW();
+            """, category, [uuid for uuid in uuids if uuid is not None][:keep], posted_at, keep)
+        return True, f"Watermark of {category} updated"
+    except Exception as e:
+        return False, f"Could not update the watermark of {category} - {e}"
@@ -1,58 +1,50 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import traceback
-import pickle
 import asyncio
 import json
+import socket
 import re
 import os
 from dotenv import load_dotenv
 
 from nyx.browser import NyxBrowser
 from nyx.page import NyxPage
+from nyx.route_blocklist import RouteBlocklist
 
 from upwork_agent.bidder_agent import build_bidder_agent,call_proposal_generator_agent, Proposal
+from utils.models import BulkEnqueueRequest
 from db_utils.db_pool import init_pool, close_pool
 from db_utils.access_db import add_proposal, create_proposals_table, create_jobs_table, get_job_by_url
-from db_utils.queue_manager import create_queue_table, enqueue_task, get_next_task, update_task_status, abort_tasks_on_restart
+from db_utils.queue_manager import create_queue_table, create_queue_history_table, archive_finished_tasks, enqueue_task, enqueue_tasks, \
+    update_task_status, fail_task, cancel_task, requeue_expired_tasks, get_task, get_queue_stats, FINISHED_STATUSES
+from db_utils.queue_listener import QueueListener
+from db_utils.seen_jobs import SeenJobIndex
+from db_utils.watermarks import create_watermarks_table
+from db_utils.outbox import create_outbox_table, purge_delivered_outbox_events, get_outbox_stats
+from utils.webhook_dispatcher import WebhookDispatcher
+from utils.http_client import create_http_client
+from utils.constants import lease_reaper_interval, browser_lane_concurrency, llm_lane_concurrency, task_archive_interval, task_status_channel, \
+    detail_page_pool_size, search_page_pool_size, scrape_blocked_resource_types, scrape_blocked_url_patterns, scrape_allowed_url_patterns, \
+    apply_batch_max_jobs, apply_batch_page_pool_size
+from utils.worker_pool import WorkerSupervisor, WorkerLane
 from utils import generate_search_links
 from utils.prompts_archive import PromptArchive
 from rag_utils.embed_data import check_embeddings_exist, embed_documents, create_docs_from_csv, ensure_pgvector
 
 from upwork_agent.scrape_jobs import ScraperSession
-from upwork_agent.application import ApplicationSession
+from upwork_agent.application import ApplicationSession, BatchApplicationSession
 
 load_dotenv()
 
 LOGIN_USERNAME = os.getenv("UPWORK_USERNAME")
 LOGIN_PASSWORD = os.getenv("UPWORK_PASSWORD")
 SECURITY_QUESTION_ANSWER = os.getenv("UPWORK_SECURITY_QUESTION_ANSWER")
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
 
 state = {}
-latest_urls_path = 'state_data/latest_links.pkl'
-if os.path.exists(latest_urls_path):
-    print("Loading latest URLs from", latest_urls_path)
-    with open(latest_urls_path, 'rb') as f:
-        latest_urls = pickle.load(f)
-    print("Latest URLs loaded:", latest_urls)
-else:
-    print("No latest URLs file found, initializing with None values.")
-    latest_urls = {
-        "Frontend" : None,
-        "Backend" : None,
-        "Fullstack" : None,
-        "Mobile" : None,
-        "AI/ML" : None,
-        "GenAI" : None,
-        "Devops" : None,
-        "IOT" : None,
-        "Low code/No code" : None,
-        "Non Tech" : None,
-        "Data Engineering" : None,
-        "Business Intelligence" : None,
-        "Best Match" : None
-    }
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -61,10 +53,16 @@ async def lifespan(app: FastAPI):
     await browser.start()
     state['browser'] = browser
     print("Browser started")
+    # Only the WebhookDispatcher sends HTTP, sessions write their events to the outbox
+    http_client = create_http_client()
     state["filter_urls"] = generate_search_links()
-    state["latest_urls"] = latest_urls
-    page:NyxPage = await state.get("browser").new_page()
-    state["page"] = page
+    # The browser lane logs in and applies to jobs, so it loads pages untouched
+    browser_lane_pool = await browser.create_page_pool("browser_lane", browser_lane_concurrency)
+    state["browser_lane_pool"] = browser_lane_pool
+    state["apply_page_pool"] = await browser.create_page_pool("apply_batch", apply_batch_page_pool_size)
+    scrape_blocklist = RouteBlocklist(scrape_blocked_resource_types, scrape_blocked_url_patterns, scrape_allowed_url_patterns)
+    state["detail_page_pool"] = await browser.create_page_pool("scrape_details", detail_page_pool_size, blocklist=scrape_blocklist)
+    state["search_page_pool"] = await browser.create_page_pool("scrape_search", search_page_pool_size, blocklist=scrape_blocklist)
     if not check_embeddings_exist():
         embed_documents(create_docs_from_csv("data/proposals.csv"))
     await init_pool()
@@ -81,16 +79,54 @@ async def lifespan(app: FastAPI):
     print(proposal_table_status, msg)
     job_table_status, msg = await create_jobs_table()
     print(job_table_status, msg)
+    state["seen_jobs"] = await SeenJobIndex.from_jobs_table()
+    watermarks_table_status, msg = await create_watermarks_table()
+    print(watermarks_table_status, msg)
+    outbox_table_status, msg = await create_outbox_table()
+    print(outbox_table_status, msg)
     task_queue_table_status, msg = await create_queue_table()
     print(task_queue_table_status, msg)
-    abort_status, msg = await abort_tasks_on_restart()
-    print(abort_status, msg)
-    worker_task = asyncio.create_task(worker_loop())
-    print("Worker loop started")
+    task_history_table_status, msg = await create_queue_history_table()
+    print(task_history_table_status, msg)
+    # In-flight tasks of a crashed/restarted worker are retried once their lease runs out
+    requeue_status, msg = await requeue_expired_tasks()
+    print(requeue_status, msg)
+    queue_listener = QueueListener()
+    await queue_listener.start()
+    state["queue_listener"] = queue_listener
+    print("Queue listener started")
+    supervisor = WorkerSupervisor(
+        worker_id=WORKER_ID,
+        listener=queue_listener,
+        handlers={
+            "check_for_jobs" : check_for_jobs,
+            "apply_for_job" : apply_for_job,
+            "apply_batch" : apply_batch,
+            "generate_proposal" : generate_proposal_task,
+        },
+        lanes=[
+            # A scrape and an application can share the browser, but only one scrape at a time
+            WorkerLane("browser", ["check_for_jobs", "apply_for_job", "apply_batch"], page_pool=browser_lane_pool, type_limits={"check_for_jobs" : 1, "apply_batch" : 1}),
+            WorkerLane("llm", ["generate_proposal"], concurrency=llm_lane_concurrency),
+        ]
+    )
+    await supervisor.start()
+    state["supervisor"] = supervisor
+    print(f"Worker supervisor started as {WORKER_ID}")
+    webhook_dispatcher = WebhookDispatcher(queue_listener, client=http_client)
+    await webhook_dispatcher.start()
+    state["webhook_dispatcher"] = webhook_dispatcher
+    reaper_task = asyncio.create_task(lease_reaper_loop())
+    archiver_task = asyncio.create_task(task_archiver_loop())
     yield
     # Shutdown code
     # cm.__exit__(None, None, None)
-    worker_task.cancel()
+    await supervisor.stop()
+    await webhook_dispatcher.stop()
+    await http_client.aclose()
+    reaper_task.cancel()
+    archiver_task.cancel()
+    await queue_listener.close()
     await close_pool()
     print("Database pool closed")
     await state['browser'].shutdown()
@@ -122,21 +158,98 @@ app.add_middleware(
 
 
 
+def check_task_types(task_types:list[str]):
+    """Reject task types no handler is registered for, such a task would sit in the queue forever."""
+    supervisor:WorkerSupervisor = state["supervisor"]
+    unknown = sorted(set(task_types) - set(supervisor.handlers))
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown task types {unknown}, expected one of {sorted(supervisor.handlers)}")
+
 @app.get("/enqueue_task")
-async def enqueue_task_api(task_type:str, payload = None, priority:int=0):
+async def enqueue_task_api(task_type:str, payload = None, priority:int=0, dedupe_key:str = None):
+    check_task_types([task_type])
     print(f"Enqueuing task: {task_type} with payload: {payload} and priority: {priority}")
-    status, message = await enqueue_task(task_type=task_type, payload=payload, priority=priority)
+    status, message = await enqueue_task(task_type=task_type, payload=payload, priority=priority, dedupe_key=dedupe_key)
+    return {"status" : status, "message" : message}
+
+@app.post("/enqueue_tasks")
+async def enqueue_tasks_api(request:BulkEnqueueRequest):
+    check_task_types([task.task_type for task in request.tasks])
+    print(f"Enqueuing {len(request.tasks)} tasks")
+    status, message = await enqueue_tasks([task.model_dump() for task in request.tasks])
     return {"status" : status, "message" : message}
 
-async def check_for_jobs(task_id:int):
+@app.get("/queue/stats")
+async def queue_stats_api():
+    status, stats = await get_queue_stats()
+    if status:
+        return {"status" : "Done", "value" : stats}
+    return {"status" : "Failed", "message" : stats}
+
+@app.get("/browser/route_stats")
+async def route_stats_api():
+    pools = state["browser"].page_pools
+    return {"status" : "Done", "value" : {pool.name : pool.route_stats() for pool in pools}}
+
+@app.get("/outbox/stats")
+async def outbox_stats_api():
+    status, stats = await get_outbox_stats()
+    if status:
+        dispatcher:WebhookDispatcher = state["webhook_dispatcher"]
+        return {"status" : "Done", "value" : {"events" : stats, "delivered" : dispatcher.delivered, "failed" : dispatcher.failed}}
+    return {"status" : "Failed", "message" : stats}
+
+@app.get("/tasks/{task_id}")
+async def get_task_api(task_id:int):
+    task = await get_task(task_id)
+    if task:
+        return {"status" : "Done", "value" : task}
+    return {"status" : "Failed", "message" : f"Task {task_id} not found."}
+
+@app.post("/tasks/{task_id}/cancel")
+async def cancel_task_api(task_id:int):
+    status, message = await cancel_task(task_id)
+    return {"status" : "Done" if status else "Failed", "message" : message}
+
+@app.get("/tasks/{task_id}/events")
+async def task_events_api(task_id:int):
+    """Server-sent events with the task row every time its status or messages change, until it finishes."""
+    async def event_stream():
+        listener:QueueListener = state["queue_listener"]
+        updates = await listener.subscribe(task_status_channel)
+        try:
+            task = await get_task(task_id)
+            if not task:
+                yield f"event: error\ndata: {json.dumps({'message' : f'Task {task_id} not found.'})}\n\n"
+                return
+            yield f"data: {json.dumps(task, default=str)}\n\n"
+            while task.get("status") not in FINISHED_STATUSES:
+                try:
+                    notification = await asyncio.wait_for(updates.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if json.loads(notification).get("id") != task_id:
+                    continue
+                task = await get_task(task_id) or task
+                yield f"data: {json.dumps(task, default=str)}\n\n"
+        finally:
+            listener.unsubscribe(task_status_channel, updates)
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+async def check_for_jobs(task:dict, page:NyxPage):
+    task_id = task["id"]
     session = ScraperSession(
             task_id=task_id,
-            page = state["page"], 
+            page = page, 
             links_to_visit=state["filter_urls"], 
-            last_links=state["latest_urls"], 
             username= LOGIN_USERNAME, 
             password=LOGIN_PASSWORD, 
-            security_answer=SECURITY_QUESTION_ANSWER
+            security_answer=SECURITY_QUESTION_ANSWER,
+            detail_pool=state["detail_page_pool"],
+            search_pool=state["search_page_pool"],
+            seen_jobs=state["seen_jobs"],
+            worker_id=task["worker_id"]
         )
     await session.run()
     
@@ -197,6 +310,9 @@ async def get_proposal_prompt_by_version_api(version:int):
 
 @app.post("/generate_proposal")
 async def generate_proposal_api(job_url:str):
+    return await generate_proposal(job_url)
+
+async def generate_proposal(job_url:str):
     try:
         job_uuid, job_details = await get_job_by_url(job_url=job_url)
         if not job_details:
@@ -224,16 +340,53 @@ async def generate_proposal_api(job_url:str):
         traceback.print_exc()
         return {"status" : "Failed", "message" : str(e)}
     
+async def generate_proposal_task(task:dict):
+    payload_string = task.get("payload","")
+    payload = json.loads(payload_string) if payload_string else {}
+    job_url = payload.get("job_url", "")
+    if not job_url:
+        await update_task_status(task_id=task["id"], status='failed', worker_id=task["worker_id"])
+        return
+    result = await generate_proposal(job_url)
+    if result.get("status") == "Done":
+        await update_task_status(task_id=task["id"], status='done', worker_id=task["worker_id"])
+    else:
+        await fail_task(task["id"], worker_id=task["worker_id"])
 
-async def apply_for_job(task_id:int,job_url: str, human:str = "Unable to verify"):
+async def apply_for_job(task:dict, page:NyxPage, human:str = "Unable to verify"):
+    payload_string = task.get("payload","")
+    payload = json.loads(payload_string) if payload_string else {}
+    job_url = payload.get("job_url", "")
+    if not job_url:
+        await update_task_status(task_id=task["id"], status='failed', worker_id=task["worker_id"])
+        return
     session = ApplicationSession(
-            task_id=task_id,
-            page = state["page"], 
+            task_id=task["id"],
+            page = page, 
             job_url=job_url,
             username= LOGIN_USERNAME, 
             password=LOGIN_PASSWORD, 
             security_answer=SECURITY_QUESTION_ANSWER , 
-            human=human
+            human=human,
+            worker_id=task["worker_id"]
+        )
+    await session.run()
+
+async def apply_batch(task:dict, page:NyxPage, human:str = "Unable to verify"):
+    """Apply to up to `max_jobs` (payload) pending apply_for_job tasks in one browser session."""
+    payload_string = task.get("payload","")
+    payload = json.loads(payload_string) if payload_string else {}
+    session = BatchApplicationSession(
+            task_id=task["id"],
+            page = page,
+            worker_id=task["worker_id"],
+            username= LOGIN_USERNAME,
+            password=LOGIN_PASSWORD,
+            security_answer=SECURITY_QUESTION_ANSWER,
+            human=human,
+            page_pool=state["apply_page_pool"],
+            max_jobs=int(payload.get("max_jobs", apply_batch_max_jobs)),
+            supervisor=state["supervisor"]
         )
     await session.run()
             
@@ -247,32 +400,20 @@ def question_answer_parser(proposal:Proposal):
     return q_a_dict
 
 
-async def worker_loop():
+async def lease_reaper_loop():
     while True:
-        try:
-            status,task = await get_next_task()
-            if status:
-                task_id = task['id']
-                task_type = task['task_type']
-                print(f"Processing task: {task_type}")
-                for key, value in task.items():
-                    print(f"{key}: {value}")
-                if task_type == 'check_for_jobs':
-                    await check_for_jobs(task_id=task_id)
-                    await update_task_status(task_id=task_id, status='done')
-                elif task_type == 'apply_for_job':
-                    payload_string = task.get("payload","")
-                    payload = json.loads(payload_string) if payload_string else {}
-                    job_url = payload.get("job_url", "")
-                    if job_url:
-                        await apply_for_job(task_id=task_id,job_url=job_url)
-            else:
-                print("No tasks in queue, waiting...")
-        except Exception as e:
-            print(f"Error in worker loop: {e}")
-            traceback.print_exc()
-        finally:
-            await asyncio.sleep(3)
+        await asyncio.sleep(lease_reaper_interval)
+        requeue_status, msg = await requeue_expired_tasks()
+        if not requeue_status:
+            print(msg)
+
+async def task_archiver_loop():
+    while True:
+        archive_status, msg = await archive_finished_tasks()
+        print(archive_status, msg)
+        purge_status, msg = await purge_delivered_outbox_events()
+        print(purge_status, msg)
+        await asyncio.sleep(task_archive_interval)
 
 if __name__ == "__main__":
     hehe = asyncio.run(question_answer_parser("https://www.upwork.com/jobs/~021970706874169818481?link=new_job&frkscc=NYf13dCiTalJ"))
@@ -5,6 +5,7 @@ from typing import Union, Optional, Dict
 
 from nyx.page import NyxPage
 from nyx.page_pool import PagePool
+from nyx.route_blocklist import RouteBlocklist
 from utils.constants import cdp_url, cdp_port, chrome_executable_path, user_data_dir, home_url
 from utils.chrome_utils import wait_for_cdp
 
@@ -47,8 +48,11 @@ class NyxBrowser:
         
         
         
-    async def create_page_pool(self, page_pool_name:str, page_pool_size:int =5) -> PagePool:
-        """Create a pool of pages (tabs) in the first browser context."""
+    async def create_page_pool(self, page_pool_name:str, page_pool_size:int =5, blocklist:Optional[RouteBlocklist] = None) -> PagePool:
+        """
+        Create a pool of pages (tabs) in the first browser context.
+        With a `blocklist`, every page of the pool aborts the requests it matches.
+        """
         if not self.engine:
             raise RuntimeError("Browser not started")
         context = self.engine.contexts[0] if self.engine.contexts else await self.engine.new_context()
@@ -57,12 +61,16 @@ class NyxBrowser:
             if self.num_pages == 0:
                 page = context.pages[0]
                 page = await NyxPage.page_with_tracking(page)
+                if blocklist:
+                    await page.enable_blocking(blocklist)
                 await page.goto(home_url)
                 pages.append(page)
                 self.num_pages += 1
                 continue
             page = await context.new_page()
             page = await NyxPage.page_with_tracking(page)
+            if blocklist:
+                await page.enable_blocking(blocklist)
             pages.append(page)
             self.num_pages += 1
         page_pool = PagePool(pages, page_pool_name)
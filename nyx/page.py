@@ -3,15 +3,19 @@ import asyncio
 from typing import Union, Optional, List
 import traceback
 
-from playwright.async_api import Page, ElementHandle
+from playwright.async_api import Page, ElementHandle, Route
 from playwright.async_api import TimeoutError
 
 from nyx.cursor import VisualGhostCursor
+from nyx.route_blocklist import RouteBlocklist, NavigationRouteStats
+from utils.constants import home_url
 
 class NyxPage:
     def __init__(self, page: Page, cursor):
         self._page = page
         self.nyx_cursor = cursor
+        self.blocklist: Optional[RouteBlocklist] = None
+        self.route_stats: Optional[NavigationRouteStats] = None
         
     @classmethod  
     async def page_with_tracking(cls, page:Page):
@@ -23,15 +27,43 @@ class NyxPage:
         # delegate unknown attributes to real Playwright page
         return getattr(self._page, name)
     
+    async def enable_blocking(self, blocklist:RouteBlocklist):
+        """Abort every request of this page matched by `blocklist`."""
+        self.blocklist = blocklist
+        self.route_stats = NavigationRouteStats()
+        await self._page.route("**/*", self._route_request)
+
+    async def _route_request(self, route:Route):
+        request = route.request
+        try:
+            if self.blocklist.should_block(request):
+                self.route_stats.record_blocked(RouteBlocklist.estimated_size(request))
+                await route.abort()
+            else:
+                await route.continue_()
+        except Exception as e:
+            # The page may have navigated away or closed while the request was pending
+            print(f"Warning: Could not route {request.url}: {e}")
+
     async def go_back(self):
         try:
             await self._page.go_back()
         except Exception as e:
             print(f"Exception occured : {e}")
         
+    async def reset(self, url: str = home_url):
+        """Stop whatever the page is doing and park it on `url`. Old element handles become stale."""
+        try:
+            await self._page.evaluate("window.stop()")
+        except Exception as e:
+            print(f"Warning: Could not stop page: {e}")
+        await self.goto(url)
+        
     async def goto(self, url: str, captcha_selector:Union[str,ElementHandle] = None, wait_for = None, **kwargs):
         """Navigate to a URL"""
         kwargs.setdefault("timeout", 30000)
+        if self.route_stats:
+            self.route_stats.start_navigation()
         try:
             await self._page.goto(url, **kwargs)
             self.nyx_cursor = await VisualGhostCursor.cursor_with_tracking(self._page)
@@ -44,6 +76,9 @@ class NyxPage:
             print(f"Warning: Could not navigate to {url}: {e}")
         finally:
             print(f"Finished attempting to navigate to {url}")
+            if self.route_stats:
+                stats = self.route_stats.finish_navigation(url)
+                print(f"Blocked {stats['blocked_requests']} requests on {url} (~{stats['estimated_bytes_saved'] // 1024} KB saved)")
 
     async def click(self, selector:Optional[Union[str, ElementHandle]],wait_for:Optional[Union[str, ElementHandle]] = None, expect_navigation:bool = False):
         """Perform a click with the visual cursor"""
@@ -185,10 +220,12 @@ class NyxPage:
             return None 
         
     async def copy_to_clipboard(self, text: str):
+        """Raises when the text could not be copied, pasting afterwards would insert whatever was copied before."""
         try:
             await self._page.evaluate("(text) => navigator.clipboard.writeText(text)", text)
         except Exception as e:
             print(f"Could not copy text : {e}")
+            raise
             
     async def paste_from_clipboard(self, selector:Union[str, ElementHandle], to_enter:bool = False):
         try:
@@ -198,6 +235,7 @@ class NyxPage:
                 await self._page.keyboard.press("Enter")
         except Exception as e:
             print(f"Warning: Could not fill field and press Enter: {e}")
+            raise
         
     
     async def get_all_elements(self, selector:Union[str, ElementHandle]):
@@ -16,10 +16,11 @@ class PagePool:
         """Acquire a page from the pool."""
         return await self.idle_pages.get()
     
-    async def release(self, page: NyxPage):
-        """Release a page back to the pool."""
-        await asyncio.sleep(2)
-        await page.goto(home_url)
+    async def release(self, page: NyxPage, reset: bool = True):
+        """Release a page back to the pool. Pass reset=False for a page that was not used."""
+        if reset:
+            await asyncio.sleep(2)
+            await page.goto(home_url)
         await self.idle_pages.put(page)
     
     def size(self) -> int:
@@ -28,4 +29,14 @@ class PagePool:
     
     def idle_count(self) -> int:
         """Get the number of idle pages currently available."""
-        return self.idle_pages.qsize()
\ No newline at end of file
+        return self.idle_pages.qsize()
+    
+    def route_stats(self) -> dict:
+        """Requests blocked by the pages of this pool, if it was created with a blocklist."""
+        page_stats = [page.route_stats.as_dict() for page in self.pages if page.route_stats]
+        return {
+            "blocking" : bool(page_stats),
+            "blocked_requests" : sum(stats["blocked_requests"] for stats in page_stats),
+            "estimated_bytes_saved" : sum(stats["estimated_bytes_saved"] for stats in page_stats),
+            "pages" : page_stats,
+        }
\ No newline at end of file
@@ -0,0 +1,64 @@
+import re
+from typing import Iterable, Optional
+
+from playwright.async_api import Request
+
+from utils.constants import resource_size_estimates
+
+class RouteBlocklist:
+    """
+    Rules for requests a page should never send: whole resource types (image, font, ...)
+    and URLs matching any of the given regex patterns (analytics, trackers, ...).
+    Aborted requests never reach the network, so what they would have cost is only
+    known approximately, from `resource_size_estimates`.
+    """
+    def __init__(self, resource_types:Iterable[str] = (), url_patterns:Iterable[str] = (), allowed_url_patterns:Iterable[str] = ()):
+        self.resource_types = set(resource_types)
+        self.url_patterns = [re.compile(pattern) for pattern in url_patterns]
+        # Checked first, so e.g. the Cloudflare challenge keeps loading whatever else is blocked
+        self.allowed_url_patterns = [re.compile(pattern) for pattern in allowed_url_patterns]
+
+    def should_block(self, request:Request) -> bool:
+        if request.is_navigation_request():
+            return False
+        url = request.url
+        if any(pattern.search(url) for pattern in self.allowed_url_patterns):
+            return False
+        if request.resource_type in self.resource_types:
+            return True
+        return any(pattern.search(url) for pattern in self.url_patterns)
+
+    @staticmethod
+    def estimated_size(request:Request) -> int:
+        return resource_size_estimates.get(request.resource_type, resource_size_estimates["other"])
+
+
+class NavigationRouteStats:
+    """Requests a page blocked during its current navigation and since it was created."""
+    def __init__(self):
+        self.blocked_requests = 0
+        self.bytes_saved = 0
+        self.total_blocked_requests = 0
+        self.total_bytes_saved = 0
+        self.last_navigation: Optional[dict] = None
+
+    def start_navigation(self):
+        self.blocked_requests = 0
+        self.bytes_saved = 0
+
+    def record_blocked(self, size:int):
+        self.blocked_requests += 1
+        self.bytes_saved += size
+        self.total_blocked_requests += 1
+        self.total_bytes_saved += size
+
+    def finish_navigation(self, url:str) -> dict:
+        self.last_navigation = {"url" : url, "blocked_requests" : self.blocked_requests, "estimated_bytes_saved" : self.bytes_saved}
+        return self.last_navigation
+
+    def as_dict(self) -> dict:
+        return {
+            "blocked_requests" : self.total_blocked_requests,
+            "estimated_bytes_saved" : self.total_bytes_saved,
+            "last_navigation" : self.last_navigation,
+        }
@@ -0,0 +1,72 @@
+import copy
+import json
+import re
+from pathlib import Path
+
+import pytest
+
+from upwork_agent.job_payload import map_job_payload
+from utils.job_filter import JobFilter
+
+# Recorded from real job pages with `python -m upwork_agent.offline_parser record <uuid>`:
+# the payloads the page received, and the job_details the same page gave through the DOM
+CAPTURED = sorted((Path(__file__).parent / "fixtures" / "captured").glob("*.json"))
+
+# Fields both sources render the same way
+EXACT_FIELDS = ["client_location", "payment_verified", "member_since", "duration_type", "duration", "hourly_rate", "job_type", "skills", "qualified", "questions"]
+
+def first_mapped(payloads:list):
+    """The job_details JobPayloadCapture.extract would return for `payloads`."""
+    for payload in payloads:
+        job_details = map_job_payload(payload)
+        if job_details:
+            return job_details
+    return None
+
+@pytest.mark.parametrize("fixture_path", CAPTURED, ids=[path.stem for path in CAPTURED])
+def test_captured_payload_matches_dom(fixture_path):
+    fixture = json.loads(fixture_path.read_text())
+    dom_details = fixture["job_details"]
+    job_details = first_mapped(fixture["payloads"])
+    assert job_details is not None, "no payload mapped, PAYLOAD_FIELD_PATHS do not match this response"
+    for field in EXACT_FIELDS:
+        assert job_details[field] == dom_details[field], field
+    assert " ".join(job_details["summary"].split()) == " ".join(dom_details["summary"].split())
+    # The page rounds both of these for display
+    assert re.search(r"(\d+)%", job_details["hire_rate"]).group(1) == re.search(r"(\d+)%", dom_details["hire_rate"]).group(1)
+    job_filter = JobFilter()
+    assert job_filter.get_total_spent(job_details["total_spent"]) == pytest.approx(job_filter.get_total_spent(dom_details["total_spent"]), rel=0.1)
+    assert job_filter.is_job_allowed(job_details) == job_filter.is_job_allowed(dom_details)
+
+# Only the fallback rules are tested on this hand-built payload, the field paths are covered by CAPTURED
+PAYLOAD = {
+    "data" : {
+        "jobAuthDetails" : {
+            "buyer" : {
+                "location" : {"country" : "United States"},
+                "jobs" : {"postedCount" : 8, "openCount" : 2},
+                "stats" : {"totalJobsWithHires" : 6, "totalCharges" : {"amount" : 84250}},
+                "isPaymentMethodVerified" : True,
+            },
+            "job" : {"description" : "We need a Python developer.", "type" : "HOURLY"},
+        }
+    }
+}
+
+def test_missing_filter_field_falls_back_to_dom():
+    assert map_job_payload(PAYLOAD) is not None
+    for path in (("stats", "totalJobsWithHires"), ("stats", "totalCharges"), ("isPaymentMethodVerified",)):
+        payload = copy.deepcopy(PAYLOAD)
+        parent = payload["data"]["jobAuthDetails"]["buyer"]
+        for key in path[:-1]:
+            parent = parent[key]
+        del parent[path[-1]]
+        assert map_job_payload(payload) is None, path
+
+def test_unverified_payment_is_mapped_not_missing():
+    payload = copy.deepcopy(PAYLOAD)
+    payload["data"]["jobAuthDetails"]["buyer"]["isPaymentMethodVerified"] = False
+    assert map_job_payload(payload)["payment_verified"] is False
+
+def test_non_job_payload_is_rejected():
+    assert map_job_payload({"data" : {"viewer" : {}}}) is None
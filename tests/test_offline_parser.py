@@ -0,0 +1,93 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from upwork_agent.offline_parser import parse_job_html, parse_feed_html
+from upwork_agent.job_fields import JOB_PAGE_FIELDS, SEARCH_FEED, build_job_details
+from utils.field_spec import extract_fields, extract_items
+from utils.exceptions import PrivateProfileError
+
+FIXTURES = Path(__file__).parent / "fixtures"
+JOB_PAGE = (FIXTURES / "job_page.html").read_text()
+SEARCH_FEED_PAGE = (FIXTURES / "search_feed.html").read_text()
+
+JOB_DETAILS = {
+    "client_location" : "United States",
+    "hire_rate" : "75% hire rate, 2 open jobs",
+    "total_spent" : "$84K",
+    "member_since" : "Member since Mar 14, 2019",
+    "payment_verified" : True,
+    "summary" : "We need a Python developer to build a Playwright scraper and a FastAPI service. The scraper runs against a logged in session and stores results in Postgres.",
+    "duration_type" : "duration2",
+    "duration" : "1 to 3 months",
+    "hourly_rate" : "$25.00-$45.00",
+    "job_type" : "Hourly",
+    "skills" : "Python\n, Web Scraping\n, FastAPI\n",
+    "qualified" : True,
+    "questions" : "1. Describe a scraper you have built.\n 2. How do you handle captchas?\n",
+}
+
+def live_extraction(html:str, extract):
+    """Run `extract(page)` with the live, page.evaluate based extraction over `html` in a real browser."""
+    async_api = pytest.importorskip("playwright.async_api")
+
+    async def run():
+        async with async_api.async_playwright() as playwright:
+            try:
+                browser = await playwright.chromium.launch()
+            except Exception as e:
+                pytest.skip(f"No browser to run the live extraction: {e}")
+            try:
+                page = await browser.new_page()
+                # No network: the fixtures are self contained and their scripts are not needed
+                await page.route("**/*", lambda route: route.abort())
+                await page.set_content(html)
+                return await extract(page)
+            finally:
+                await browser.close()
+
+    return asyncio.run(run())
+
+def test_parses_job_page():
+    assert parse_job_html(JOB_PAGE) == JOB_DETAILS
+
+def test_job_page_matches_live_extraction():
+    live_fields = live_extraction(JOB_PAGE, lambda page: extract_fields(page, JOB_PAGE_FIELDS))
+    assert parse_job_html(JOB_PAGE) == build_job_details(live_fields)
+
+def test_private_job_page_is_rejected():
+    private_page = JOB_PAGE.replace('data-qa="client-location"', 'data-qa="client-location-hidden"')
+    with pytest.raises(PrivateProfileError):
+        parse_job_html(private_page)
+
+def test_parses_search_feed():
+    tiles = parse_feed_html(SEARCH_FEED_PAGE)
+    assert tiles == [
+        {
+            "posted_text" : "Posted 12 minutes ago",
+            "href" : "/jobs/Python-developer-for-Playwright-scraper-and-FastAPI-service_~021953012345678901234/?referrer_url_path=/nx/search/jobs/",
+            "uuid" : 1953012345678901234,
+            "title" : "Python developer for a Playwright scraper and FastAPI service",
+            "snippet" : "We need a Python developer to build a Playwright scraper and a FastAPI service.",
+            "payment_status" : "Payment verified",
+            "total_spent" : "$84K+",
+            "client_location" : "United States",
+            "job_type" : "Hourly: $25.00 - $45.00",
+        },
+        {
+            "posted_text" : "Posted 1 hour ago",
+            "href" : "/jobs/Fix-a-broken-Django-migration_~021953009876543210987/?referrer_url_path=/nx/search/jobs/",
+            "uuid" : 1953009876543210987,
+            "title" : "Fix a broken Django migration",
+            "snippet" : "A migration fails on deploy after a model rename, need it fixed today.",
+            "payment_status" : "Payment unverified",
+            "total_spent" : None,
+            "client_location" : "India",
+            "job_type" : "Fixed price",
+        },
+    ]
+
+def test_search_feed_matches_live_extraction():
+    live_tiles = live_extraction(SEARCH_FEED_PAGE, lambda page: extract_items(page, SEARCH_FEED.tile_selector, SEARCH_FEED.fields))
+    assert parse_feed_html(SEARCH_FEED_PAGE) == live_tiles
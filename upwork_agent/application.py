@@ -1,15 +1,25 @@
 from utils.session import Session
-from utils.constants import upwork_login_url, cloudfare_challenge_div_id, upwork_url, home_url, send_job_updates_webhook_url, send_job_updates_webhook_url_test
+from utils.constants import cloudfare_challenge_div_id, home_url, send_job_updates_webhook_url, send_job_updates_webhook_url_test, \
+    apply_batch_max_jobs, task_heartbeat_interval, task_type_deadlines, default_task_deadline
 from utils.models import Proposal
 
-from db_utils.access_db import get_proposal_by_url, update_proposal_by_url
-from db_utils.queue_manager import update_task_status
+from db_utils.access_db import get_proposal_by_url, update_proposal_by_url, get_proposals_by_urls, update_proposals_applied
+from db_utils.queue_manager import update_task_status, fail_task, claim_tasks, extend_task_leases
 
-from typing import Literal, Optional
+from typing import Literal, Optional, TYPE_CHECKING
 import asyncio
+import json
 import re 
 
 from nyx.page import NyxPage
+from nyx.page_pool import PagePool
+
+# The clipboard is shared by every tab of the browser: one application form is filled at a time,
+# whichever lane slot or batch it belongs to
+form_fill_lock = asyncio.Lock()
+
+if TYPE_CHECKING:
+    from utils.worker_pool import WorkerSupervisor
 
 class ApplicationSession(Session):
     def __init__(self,
@@ -21,64 +31,58 @@ class ApplicationSession(Session):
                  human:str,
                  security_answer:str = None, 
                  status_endpoint:str = send_job_updates_webhook_url,
+                 worker_id:str = None,
                  ):
-        super().__init__(task_id, page, username, password, security_answer, status_endpoint)
+        super().__init__(task_id, page, username, password, security_answer, status_endpoint, worker_id=worker_id)
         self.job_url = job_url
         self.human = human
         self.applied = False
+        # Set once the form is being filled, from then on a retry could apply twice
+        self.form_started = False
         self.proposal:Optional[Proposal] = None
         self.proposal_type:Optional[Literal["Hourly", "Fixed Price"]] = None
         
     async def run(self):
         try:
-            client_setup_success = await self.setup_client()
-            if not client_setup_success:
-                return False
-        except Exception as e:
-            print(f"Error setting up client: {e}")
-        try:
-            client_setup_success = await self.setup_client()
-            if not client_setup_success:
-                await update_task_status(self.task_id, "failed")
-                return False
             proposal_fetch_status = await self.get_proposal()
             if not proposal_fetch_status:
                 await self.send_status()
                 self.print_status()
-                await update_task_status(self.task_id, "failed")
+                await fail_task(self.task_id, error=self.status, worker_id=self.worker_id)
                 return False
-            login_status = await self.login(upwork_login_url)
+            login_status = await self.login()
             if not login_status:
                 await self.send_status()
                 self.print_status()
-                await update_task_status(self.task_id, "failed")
+                await fail_task(self.task_id, error=self.status, worker_id=self.worker_id)
                 return False
             reach_bidding_page_status = await self.reach_bidding_page()
             if not reach_bidding_page_status:
                 await self.send_status()
                 self.print_status()
-                await update_task_status(self.task_id, "failed")
+                await fail_task(self.task_id, error=self.status, worker_id=self.worker_id)
                 return False
             apply_status = await self.apply_for_job()
             if not apply_status:
                 await self.send_status()
                 self.print_status()
-                await update_task_status(self.task_id, "failed")
+                await fail_task(self.task_id, error=self.status, worker_id=self.worker_id)
                 return False
             update_proposal_status = await self.update_proposal_status()
             if not update_proposal_status:
                 await self.send_status()
                 self.print_status()
+                # The application form was already filled, retrying would apply twice
+                await fail_task(self.task_id, retry=False, error=self.status, worker_id=self.worker_id)
                 return False
-            await update_task_status(self.task_id, "completed")
+            await update_task_status(self.task_id, "done", result=self.status, worker_id=self.worker_id)
             self.update_status("Success", "Application process completed successfully")
             await self.send_status()
             self.print_status()
-            await self.close_client()
             await self.page.goto(home_url)
             return True
-        except Exception as e:
-            await self.close_client()
+        except Exception:
+            await fail_task(self.task_id, error=self.status, worker_id=self.worker_id)
             await self.page.goto(home_url)
             return False
         
@@ -89,6 +93,7 @@ class ApplicationSession(Session):
             await asyncio.sleep(1)
             return True
         except Exception as e:
+            self.check_login_redirect()
             self.update_status("Failed", f"Error reaching job page: {e}")
             await self.send_status()
             self.print_status()
@@ -147,21 +152,25 @@ class ApplicationSession(Session):
         try:
             if self.proposal_type == "Fixed Price":
                 return True
-            cover_letter = self.proposal.cover_letter
-            await self.page.copy_to_clipboard(cover_letter)
-            await self.page.paste_from_clipboard(selector = 'textarea[aria-labelledby="cover_letter_label"]')
-            
-            questions_and_answers = self.question_answer_parser()
-            if questions_and_answers:
-                q_a_divs = await self.page.get_all_elements(selector = 'div.fe-proposal-job-questions > div')
-                for div in q_a_divs:
-                    question_label = await div.query_selector('label.label')
-                    question_in_page = await question_label.text_content()
-                    print(question_in_page.strip())
-                    print(questions_and_answers[question_in_page.strip()])
-                    text_area = await div.query_selector('textarea')
-                    await self.page.copy_to_clipboard(questions_and_answers[question_in_page.strip()])
-                    await self.page.paste_from_clipboard(selector = text_area)
+            async with form_fill_lock:
+                self.form_started = True
+                # Clipboard writes and pastes only work reliably in the focused tab
+                await self.page.bring_to_front()
+                cover_letter = self.proposal.cover_letter
+                await self.page.copy_to_clipboard(cover_letter)
+                await self.page.paste_from_clipboard(selector = 'textarea[aria-labelledby="cover_letter_label"]')
+                
+                questions_and_answers = self.question_answer_parser()
+                if questions_and_answers:
+                    q_a_divs = await self.page.get_all_elements(selector = 'div.fe-proposal-job-questions > div')
+                    for div in q_a_divs:
+                        question_label = await div.query_selector('label.label')
+                        question_in_page = await question_label.text_content()
+                        print(question_in_page.strip())
+                        print(questions_and_answers[question_in_page.strip()])
+                        text_area = await div.query_selector('textarea')
+                        await self.page.copy_to_clipboard(questions_and_answers[question_in_page.strip()])
+                        await self.page.paste_from_clipboard(selector = text_area)
             self.applied = True 
             self.print_status()
             return True
@@ -180,6 +189,256 @@ class ApplicationSession(Session):
             answer = question_and_answer.answer.strip()
             q_a_dict[question] = answer
         return q_a_dict
-        
-    
-    
\ No newline at end of file
+
+
+class BatchApplicationSession(Session):
+    """
+    Runs several pending apply_for_job tasks in one browser session: one login, one query
+    for all their proposals, the bidding pages back to back and one UPDATE for all applied
+    flags. Every claimed task still gets its own status messages, final status, deadline
+    and lease, and can be cancelled on its own through the `supervisor`.
+    With a `page_pool` the next bidding page loads in another tab while the current form is
+    filled. Forms are filled under form_fill_lock, like standalone applications.
+    """
+    def __init__(self,
+                 task_id:int,
+                 page:NyxPage,
+                 worker_id:str,
+                 username:str,
+                 password:str,
+                 human:str,
+                 security_answer:str = None,
+                 status_endpoint:str = send_job_updates_webhook_url,
+                 page_pool:Optional[PagePool] = None,
+                 max_jobs:int = apply_batch_max_jobs,
+                 supervisor:Optional["WorkerSupervisor"] = None,
+                 ):
+        super().__init__(task_id, page, username, password, security_answer, status_endpoint, worker_id=worker_id)
+        self.human = human
+        self.page_pool = page_pool
+        self.max_jobs = max_jobs
+        self.supervisor = supervisor
+        self.deadline = task_type_deadlines.get("apply_for_job", default_task_deadline)
+        self.applications:list[ApplicationSession] = []
+        # Claimed tasks that already have their final status
+        self.settled:set[int] = set()
+        # Claimed tasks that another worker holds now, their rows are not ours to update
+        self.lost_leases:set[int] = set()
+        self.running:dict[int, asyncio.Task] = {}
+
+    async def run(self):
+        heartbeat = None
+        try:
+            claim_status, tasks = await claim_tasks(self.worker_id, "apply_for_job", self.max_jobs)
+            if not claim_status:
+                await self.send_status("Failed", tasks)
+                self.print_status()
+                await fail_task(self.task_id, error=self.status, worker_id=self.worker_id)
+                return False
+            if not tasks:
+                await self.send_status("Success", "No pending applications")
+                await update_task_status(self.task_id, "done", result=self.status, worker_id=self.worker_id)
+                return True
+            heartbeat = asyncio.create_task(self.heartbeat_loop())
+            await self.build_applications(tasks)
+            proposal_fetch_status = await self.get_proposals()
+            if not proposal_fetch_status:
+                await self.send_status()
+                self.print_status()
+                await fail_task(self.task_id, error=self.status, worker_id=self.worker_id)
+                return False
+            pending = self.pending_applications()
+            if pending:
+                login_status = await self.login()
+                if not login_status:
+                    await self.send_status()
+                    self.print_status()
+                    await fail_task(self.task_id, error=self.status, worker_id=self.worker_id)
+                    return False
+                if self.page_pool:
+                    await asyncio.gather(*(self.run_application(application) for application in pending))
+                else:
+                    # One tab, one application at a time
+                    for application in pending:
+                        await self.run_application(application)
+                await self.update_proposal_statuses()
+            done = [application for application in self.applications if application.status.get("status") == "Success"]
+            self.update_status("Success", f"Applied to {len(done)} of {len(self.applications)} jobs")
+            await update_task_status(self.task_id, "done", result=self.status, worker_id=self.worker_id)
+            await self.send_status()
+            self.print_status()
+            await self.page.goto(home_url)
+            return True
+        except Exception as e:
+            await fail_task(self.task_id, error={"status" : "Failed", "message" : f"Error in batch application: {e}"}, worker_id=self.worker_id)
+            await self.page.goto(home_url)
+            return False
+        finally:
+            if heartbeat:
+                heartbeat.cancel()
+            await self.release_unsettled()
+
+    async def build_applications(self, tasks:list[dict]):
+        for task in tasks:
+            payload_string = task.get("payload","")
+            payload = json.loads(payload_string) if payload_string else {}
+            job_url = payload.get("job_url", "")
+            if not job_url:
+                await fail_task(task["id"], retry=False, error={"status" : "Failed", "message" : "No job_url in the task payload"}, worker_id=self.worker_id)
+                self.settled.add(task["id"])
+                continue
+            self.applications.append(ApplicationSession(
+                task_id=task["id"],
+                page=self.page,
+                job_url=job_url,
+                username=self.username,
+                password=self.password,
+                human=self.human,
+                security_answer=self.security_answer,
+                status_endpoint=self.status_endpoint,
+                worker_id=self.worker_id,
+            ))
+
+    def pending_applications(self) -> list[ApplicationSession]:
+        return [application for application in self.applications if application.task_id not in self.settled]
+
+    async def get_proposals(self):
+        try:
+            fetch_status, proposals = await get_proposals_by_urls([application.job_url for application in self.applications])
+            if not fetch_status:
+                self.update_status("Failed", proposals)
+                return False
+            for application in self.applications:
+                if application.job_url not in proposals:
+                    application.update_status("Failed", "No existing proposal found for the job URL")
+                    await self.settle_failed(application)
+                    continue
+                application.proposal, application.proposal_type = proposals[application.job_url]
+            return True
+        except Exception as e:
+            self.update_status("Failed", f"Error retrieving proposals: {e}")
+            return False
+
+    async def run_application(self, application:ApplicationSession):
+        """
+        Apply for one claimed task in a task of its own, under the apply_for_job deadline,
+        so that cancelling it or losing its lease stops only this application.
+        """
+        task_id = application.task_id
+        page = await self.page_pool.get_idle_page() if self.page_pool else self.page
+        try:
+            if task_id in self.settled:
+                return
+            lease_status, held = await extend_task_leases([task_id], self.worker_id)
+            if lease_status and task_id not in held:
+                print(f"Batch {self.task_id} no longer holds task {task_id}, skipping it")
+                self.lost_leases.add(task_id)
+                self.settled.add(task_id)
+                return
+            if lease_status and held[task_id]:
+                application.update_status("Failed", "Cancelled by request")
+                await application.send_status()
+                await update_task_status(task_id, "cancelled", result=application.status, worker_id=self.worker_id)
+                self.settled.add(task_id)
+                return
+            application.page = page
+            handler_task = asyncio.create_task(asyncio.wait_for(self.apply_one(application), timeout=self.deadline))
+            self.running[task_id] = handler_task
+            if self.supervisor:
+                self.supervisor.track_task(task_id, handler_task)
+            try:
+                applied = await handler_task
+            except asyncio.TimeoutError:
+                application.update_status("Failed", f"Deadline of {self.deadline}s exceeded")
+                await self.settle_failed(application, retry=not application.form_started)
+                return
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():
+                    # The batch itself is being stopped
+                    raise
+                if task_id in self.lost_leases:
+                    print(f"Stopped task {task_id}, its lease was lost")
+                    return
+                application.update_status("Failed", "Cancelled by request")
+                await application.send_status()
+                await update_task_status(task_id, "cancelled", result=application.status, worker_id=self.worker_id)
+                self.settled.add(task_id)
+                return
+            finally:
+                self.running.pop(task_id, None)
+                if self.supervisor:
+                    self.supervisor.untrack_task(task_id)
+            if not applied:
+                await self.settle_failed(application)
+        finally:
+            if self.page_pool:
+                # The next application navigates the tab anyway
+                await self.page_pool.release(page, reset=False)
+
+    async def apply_one(self, application:ApplicationSession) -> bool:
+        reach_bidding_page_status = await application.reach_bidding_page()
+        if not reach_bidding_page_status:
+            return False
+        # Waits for form_fill_lock, shared with every other application in the process
+        return await application.apply_for_job()
+
+    async def update_proposal_statuses(self):
+        applied = [application for application in self.pending_applications() if application.proposal]
+        if not applied:
+            return
+        updates = [{"job_url" : application.job_url, "applied" : application.applied, "approved_by" : self.human} for application in applied]
+        update_status, msg = await update_proposals_applied(updates)
+        for application in applied:
+            if not update_status:
+                application.update_status("Failed", f"Database update error - {msg}")
+                # The application form was already filled, retrying would apply twice
+                await self.settle_failed(application, retry=False)
+                continue
+            await update_task_status(application.task_id, "done", result=application.status, worker_id=self.worker_id)
+            application.update_status("Success", "Application process completed successfully")
+            await application.send_status()
+            application.print_status()
+            self.settled.add(application.task_id)
+
+    async def settle_failed(self, application:ApplicationSession, retry:bool = True):
+        await application.send_status()
+        application.print_status()
+        await fail_task(application.task_id, retry=retry, error=application.status, worker_id=self.worker_id)
+        self.settled.add(application.task_id)
+
+    async def release_unsettled(self):
+        """
+        Give the claimed tasks this batch did not get to back to the queue. A task whose
+        form was already filled is not retried, as that could apply to the job twice.
+        """
+        for application in self.pending_applications():
+            if application.form_started:
+                error = {"status" : "Failed", "message" : "Batch stopped after the application form was filled, check the job before applying again"}
+                await fail_task(application.task_id, retry=False, error=error, worker_id=self.worker_id)
+            else:
+                await fail_task(application.task_id, error={"status" : "Failed", "message" : "Batch stopped before this application started"}, worker_id=self.worker_id)
+            self.settled.add(application.task_id)
+
+    async def heartbeat_loop(self):
+        """Keep the leases on the claimed tasks, and stop the applications whose lease was lost."""
+        while True:
+            await asyncio.sleep(task_heartbeat_interval)
+            task_ids = [application.task_id for application in self.pending_applications()]
+            if not task_ids:
+                continue
+            lease_status, held = await extend_task_leases(task_ids, self.worker_id)
+            if not lease_status:
+                print(f"Heartbeat for batch {self.task_id} failed - {held}")
+                continue
+            lost = set(task_ids) - set(held)
+            if lost:
+                print(f"Batch {self.task_id} lost the lease on tasks {sorted(lost)}")
+                self.lost_leases |= lost
+                self.settled |= lost
+                for task_id in lost:
+                    if task_id in self.running:
+                        self.running[task_id].cancel()
+            # Cancellations whose NOTIFY was missed, the application settles itself as cancelled
+            for task_id, cancel_requested in held.items():
+                if cancel_requested and task_id in self.running:
+                    self.running[task_id].cancel()
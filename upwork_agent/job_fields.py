@@ -0,0 +1,101 @@
+from utils.field_spec import FieldSpec
+
+def strip_or_na(value):
+    return value.strip() if value else "N/A"
+
+def strip_or_none(value):
+    return value.strip() if value and value.strip() else None
+
+# Everything scrape_job_page needs from a job detail page, fetched in one page.evaluate
+JOB_PAGE_FIELDS = [
+    FieldSpec("client_location", 'li[data-qa="client-location"] strong', post=strip_or_na),
+    FieldSpec("hire_rate", 'li[data-qa="client-job-posting-stats"] div', post=strip_or_na),
+    FieldSpec("total_spent", 'li strong[data-qa="client-spend"] span span', post=strip_or_na),
+    FieldSpec("member_since", 'li[data-qa="client-contract-date"] small', post=strip_or_na),
+    FieldSpec("payment_verified", 'div.payment-verified', "exists"),
+    FieldSpec("summary", 'div[data-test="Description"] p', "texts", post=lambda chunks: " ".join(chunk.strip() for chunk in chunks).strip()),
+    FieldSpec("duration_type", 'div[data-cy*="duration"]', "attr", attribute="data-cy", post=strip_or_na),
+    FieldSpec("duration", 'div[data-cy*="duration"] + strong > span', post=lambda duration: (duration if duration is not None else "N/A").strip()),
+    FieldSpec("fixed_price", 'div[data-cy="fixed-price"] + div strong'),
+    FieldSpec("hourly_rates", 'div[data-cy="clock-timelog"] + div strong', "texts", post=lambda rates: [rate.strip() for rate in rates]),
+    FieldSpec("skills", 'div.skills-list span span a div div', "texts", post=lambda skills: ", ".join(skill.strip() + "\n" for skill in skills)),
+    FieldSpec("has_qualifications", 'ul.qualification-items', "exists"),
+    FieldSpec("qualification_statuses", 'ul.qualification-items span.icons div', "attrs", attribute="title"),
+    FieldSpec("has_questions", 'section[data-test="Questions"]', "exists"),
+    FieldSpec("questions", 'section[data-test="Questions"] ol li', "texts"),
+]
+
+def build_job_details(fields:dict) -> dict:
+    """Turn the extracted JOB_PAGE_FIELDS into the job_details dict stored in the jobs table."""
+    job_details = {
+        "client_location" : fields["client_location"],
+        "hire_rate" : fields["hire_rate"],
+        "total_spent" : fields["total_spent"],
+        "member_since" : fields["member_since"],
+        "payment_verified" : fields["payment_verified"],
+        "summary" : fields["summary"],
+        "duration_type" : fields["duration_type"],
+        "duration" : fields["duration"],
+    }
+    if fields["fixed_price"] is not None:
+        job_details["hourly_rate"] = strip_or_na(fields["fixed_price"])
+        job_details["job_type"] = "Fixed Price"
+    else:
+        job_details["hourly_rate"] = "-".join(fields["hourly_rates"]) or "N/A"
+        job_details["job_type"] = "Hourly"
+    job_details["skills"] = fields["skills"]
+    job_details["qualified"] = not (
+        fields["has_qualifications"]
+        and "You do not meet this qualification" in fields["qualification_statuses"]
+    )
+    if fields["has_questions"]:
+        job_details["questions"] = " ".join(
+            f"{number}. {question.strip()}\n" for number, question in enumerate(fields["questions"], start=1)
+        )
+    else:
+        job_details["questions"] = "N/A"
+    return job_details
+
+def parse_uuid(uuid):
+    return int(uuid) if uuid and uuid.isdigit() else None
+
+def join_text(parts):
+    return " ".join(parts).strip()
+
+class TileFeed:
+    """Where the job tiles of a feed live and how to read one tile."""
+    def __init__(self, tile_selector:str, fields:list[FieldSpec]):
+        self.tile_selector = tile_selector
+        self.fields = fields
+
+# Category search results
+SEARCH_FEED = TileFeed(
+    tile_selector='article[data-test="JobTile"]',
+    fields=[
+        FieldSpec("posted_text", 'small[data-test="job-pubilshed-date"] span', "texts", post=join_text),
+        FieldSpec("href", 'a[data-test="job-tile-title-link UpLink"]', "attr", attribute="href"),
+        FieldSpec("uuid", 'a[data-test="job-tile-title-link UpLink"]', "attr", attribute="data-ev-job-uid", post=parse_uuid),
+        FieldSpec("title", 'a[data-test="job-tile-title-link UpLink"]', post=strip_or_na),
+        FieldSpec("snippet", 'div[data-test="JobDescription"] p', post=strip_or_na),
+        FieldSpec("payment_status", 'li[data-test="payment-verification"]', post=strip_or_none),
+        FieldSpec("total_spent", 'li[data-test="total-spent"] strong', post=strip_or_none),
+        FieldSpec("client_location", 'li[data-test="location"] span', post=strip_or_na),
+        FieldSpec("job_type", 'li[data-test="job-type-label"]', post=strip_or_na),
+    ]
+)
+
+# Best Match tab of the logged in home page
+BEST_MATCH_FEED = TileFeed(
+    tile_selector='section[data-ev-sublocation="job_feed_tile"]',
+    fields=[
+        FieldSpec("posted_text", 'span[data-test="posted-on"]', post=strip_or_na),
+        FieldSpec("href", 'a[data-ev-label="link"]', "attr", attribute="href"),
+        FieldSpec("uuid", 'a[data-ev-label="link"]', "attr", attribute="data-ev-opening_uid", post=parse_uuid),
+        FieldSpec("title", 'a[data-ev-label="link"]', post=strip_or_na),
+        FieldSpec("snippet", 'span[data-test="job-description-text"]', post=strip_or_na),
+        FieldSpec("payment_status", 'small[data-test="payment-verification-status"]', post=strip_or_none),
+        FieldSpec("total_spent", 'span[data-test="client-spendings"] strong', post=strip_or_none),
+        FieldSpec("client_location", 'small[data-test="client-country"]', post=strip_or_na),
+        FieldSpec("job_type", 'strong[data-test="job-type"]', post=strip_or_na),
+    ]
+)
@@ -0,0 +1,198 @@
+import re
+import asyncio
+from datetime import datetime
+from typing import Any, Optional, TYPE_CHECKING
+
+from utils.js_scripts import get_embedded_state_script
+from utils.constants import job_payload_url_patterns, job_payload_state_path
+
+if TYPE_CHECKING:
+    # Only needed by JobPayloadCapture, the mapping works on plain dicts without a browser
+    from playwright.async_api import Response
+    from nyx.page import NyxPage
+
+# The job details object is the embedded state itself, or wrapped by the GraphQL / REST responses
+PAYLOAD_ROOTS = ["data.jobAuthDetails", "data.jobPubDetails", "data", ""]
+
+# Candidate paths of every field inside a job details object, tried in order
+PAYLOAD_FIELD_PATHS = {
+    "client_location" : ["buyer.location.country", "opening.buyer.location.country"],
+    "jobs_posted" : ["buyer.jobs.postedCount", "buyer.stats.jobsPostedCount"],
+    "jobs_with_hires" : ["buyer.stats.totalJobsWithHires"],
+    "open_jobs" : ["buyer.jobs.openCount"],
+    "total_spent" : ["buyer.stats.totalCharges.amount"],
+    "member_since" : ["buyer.company.contractDate"],
+    "payment_verified" : ["buyer.isPaymentMethodVerified", "buyer.info.isPaymentMethodVerified"],
+    "description" : ["job.description", "opening.job.description", "opening.description"],
+    "duration_label" : ["job.engagementDuration.label", "opening.job.engagementDuration.label", "job.durationLabel"],
+    "job_type" : ["job.type", "opening.job.type"],
+    "fixed_amount" : ["job.budget.amount", "job.amount.amount", "opening.job.budget.amount"],
+    "hourly_min" : ["job.extendedBudgetInfo.hourlyBudgetMin", "opening.job.extendedBudgetInfo.hourlyBudgetMin"],
+    "hourly_max" : ["job.extendedBudgetInfo.hourlyBudgetMax", "opening.job.extendedBudgetInfo.hourlyBudgetMax"],
+    "ontology_skills" : ["sands.ontologySkills", "opening.sandsData.ontologySkills"],
+    "additional_skills" : ["sands.additionalSkills", "opening.sandsData.additionalSkills"],
+    "qualification_matches" : ["currentUserInfo.qualificationsMatches.matches"],
+    "questions" : ["job.questions", "opening.questions", "opening.job.questions"],
+}
+
+# is_job_allowed cannot judge a job without these, a payload missing any of them is left to the DOM scraper
+FILTER_FIELDS = ["hire_rate", "total_spent", "payment_verified"]
+
+# Same values the job page puts in the data-cy attribute read by the DOM scraper
+DURATION_TYPES = {
+    "less than 1 month" : "duration1",
+    "1 to 3 months" : "duration2",
+    "3 to 6 months" : "duration3",
+    "more than 6 months" : "duration4",
+}
+
+def dig(data:Any, path:str) -> Any:
+    """Follow a dotted path through nested dicts, None when any step is missing."""
+    if not path:
+        return data
+    for key in path.split("."):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+def first_of(data:dict, field:str) -> Any:
+    for path in PAYLOAD_FIELD_PATHS[field]:
+        value = dig(data, path)
+        if value not in (None, "", []):
+            return value
+    return None
+
+def format_amount(amount, decimals:int = 2) -> str:
+    return f"${float(amount):,.{decimals}f}"
+
+def skill_name(skill) -> Optional[str]:
+    if isinstance(skill, dict):
+        return skill.get("prefLabel") or skill.get("name") or skill.get("prettyName")
+    return skill if isinstance(skill, str) else None
+
+def is_fixed_price(job_type) -> bool:
+    return str(job_type).lower() in ("1", "fixed", "fixed_price", "fixed-price")
+
+def map_job_payload(data:Any) -> Optional[dict]:
+    """
+    Map a job details payload (API response or embedded state) into the job_details
+    schema produced by build_job_details, with the same string formats.
+    Returns None when the payload does not look like job details or lacks a field of
+    FILTER_FIELDS, so the caller can fall back to the DOM.
+    """
+    for root in PAYLOAD_ROOTS:
+        details = dig(data, root)
+        if isinstance(details, dict) and first_of(details, "description") and first_of(details, "client_location"):
+            break
+    else:
+        return None
+    try:
+        job_details = {
+            "client_location" : first_of(details, "client_location").strip(),
+            "hire_rate" : "N/A",
+            "total_spent" : "N/A",
+            "member_since" : "N/A",
+            "payment_verified" : "N/A",
+            "summary" : first_of(details, "description").strip(),
+            "duration_type" : "N/A",
+            "duration" : "N/A",
+        }
+        jobs_posted = first_of(details, "jobs_posted")
+        jobs_with_hires = first_of(details, "jobs_with_hires")
+        if jobs_posted and jobs_with_hires is not None:
+            open_jobs = first_of(details, "open_jobs") or 0
+            job_details["hire_rate"] = f"{round(100 * jobs_with_hires / jobs_posted)}% hire rate, {open_jobs} open job{'s' if open_jobs != 1 else ''}"
+        payment_verified = first_of(details, "payment_verified")
+        if payment_verified is not None:
+            job_details["payment_verified"] = bool(payment_verified)
+        total_spent = first_of(details, "total_spent")
+        if total_spent is not None:
+            job_details["total_spent"] = format_amount(total_spent, decimals=0)
+        member_since = first_of(details, "member_since")
+        if member_since:
+            try:
+                job_details["member_since"] = datetime.fromisoformat(member_since.replace("Z", "+00:00")).strftime("Member since %b %d, %Y")
+            except ValueError:
+                job_details["member_since"] = member_since
+        duration_label = first_of(details, "duration_label")
+        if duration_label:
+            job_details["duration"] = duration_label.strip()
+            job_details["duration_type"] = DURATION_TYPES.get(duration_label.strip().lower(), "N/A")
+        job_type = first_of(details, "job_type")
+        fixed_amount = first_of(details, "fixed_amount")
+        if is_fixed_price(job_type) or (job_type is None and fixed_amount is not None):
+            job_details["hourly_rate"] = format_amount(fixed_amount) if fixed_amount is not None else "N/A"
+            job_details["job_type"] = "Fixed Price"
+        else:
+            hourly_rates = [format_amount(rate) for rate in (first_of(details, "hourly_min"), first_of(details, "hourly_max")) if rate]
+            job_details["hourly_rate"] = "-".join(hourly_rates) or "N/A"
+            job_details["job_type"] = "Hourly"
+        skills = [skill_name(skill) for skill in (first_of(details, "ontology_skills") or []) + (first_of(details, "additional_skills") or [])]
+        job_details["skills"] = ", ".join(skill.strip() + "\n" for skill in skills if skill)
+        matches = first_of(details, "qualification_matches") or []
+        job_details["qualified"] = all(match.get("qualified", True) for match in matches if isinstance(match, dict))
+        questions = first_of(details, "questions") or []
+        questions = [question.get("question") if isinstance(question, dict) else question for question in questions]
+        questions = [question for question in questions if question]
+        if questions:
+            job_details["questions"] = " ".join(f"{number}. {question.strip()}\n" for number, question in enumerate(questions, start=1))
+        else:
+            job_details["questions"] = "N/A"
+        missing = [field for field in FILTER_FIELDS if job_details[field] == "N/A"]
+        if missing:
+            print(f"Job payload has no {', '.join(missing)}")
+            return None
+        return job_details
+    except Exception as e:
+        print(f"Error mapping job payload: {e}")
+        return None
+
+
+class JobPayloadCapture:
+    """
+    Collects the job details responses a page receives while navigating.
+    Start it before the goto, then `extract` maps the first usable one,
+    falling back to the page's embedded state. Whatever was read is kept in `captured`,
+    so it can be saved next to the page snapshot and checked against the DOM offline.
+    """
+    def __init__(self, page:"NyxPage", url_patterns:list[str] = job_payload_url_patterns, state_path:str = job_payload_state_path):
+        self.page = page
+        self.url_patterns = [re.compile(pattern) for pattern in url_patterns]
+        self.state_path = state_path
+        self.responses: list["Response"] = []
+        self.captured: list[Any] = []
+        self.listening = False
+
+    def start(self):
+        self.page.on("response", self._on_response)
+        self.listening = True
+
+    def stop(self):
+        if self.listening:
+            self.page.remove_listener("response", self._on_response)
+            self.listening = False
+
+    def _on_response(self, response:"Response"):
+        if response.ok and any(pattern.search(response.url) for pattern in self.url_patterns):
+            self.responses.append(response)
+
+    async def extract(self) -> Optional[dict]:
+        self.stop()
+        bodies = await asyncio.gather(*(response.json() for response in self.responses), return_exceptions=True)
+        for body in bodies:
+            if isinstance(body, Exception):
+                continue
+            self.captured.append(body)
+            job_details = map_job_payload(body)
+            if job_details:
+                return job_details
+        try:
+            state = await self.page.evaluate(get_embedded_state_script(), self.state_path)
+        except Exception as e:
+            print(f"Error reading embedded job state: {e}")
+            return None
+        if not state:
+            return None
+        self.captured.append(state)
+        return map_job_payload(state)
@@ -0,0 +1,75 @@
+"""
+Job extraction over saved HTML snapshots, without a browser.
+Uses the same FieldSpecs as the live scraper, so a selector fix can be checked
+against history: `python -m upwork_agent.offline_parser [uuid ...]`
+Saved job payloads become test fixtures with `python -m upwork_agent.offline_parser record uuid ...`
+"""
+import os
+import sys
+import json
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from utils.field_spec import parse_fields, parse_items
+from utils.html_snapshots import HtmlSnapshotStore
+from utils.exceptions import PrivateProfileError
+from utils.constants import html_snapshot_dir, captured_payload_fixture_dir
+from upwork_agent.job_fields import JOB_PAGE_FIELDS, build_job_details, TileFeed, SEARCH_FEED
+
+def parse_job_html(html:str) -> dict:
+    """job_details of a saved job page, as ScraperSession.scrape_job_page would build them."""
+    fields = parse_fields(html, JOB_PAGE_FIELDS)
+    if fields["client_location"] == "N/A":
+        raise PrivateProfileError("Private job posting or structure changed.")
+    return build_job_details(fields)
+
+def parse_feed_html(html:str, feed:TileFeed = SEARCH_FEED) -> list[dict]:
+    """Tiles of a saved feed, as ScraperSession.read_feed would read them."""
+    return parse_items(html, feed.tile_selector, feed.fields)
+
+def parse_job_snapshot(uuid:str, root:str = html_snapshot_dir) -> tuple[str, Optional[dict]]:
+    """Parse one saved job page. Module level so it can run in a process pool."""
+    try:
+        return uuid, parse_job_html(HtmlSnapshotStore(root).load_job(uuid))
+    except Exception as e:
+        print(f"Could not parse snapshot of job {uuid}: {e}")
+        return uuid, None
+
+def reparse_job_snapshots(uuids:Optional[list[str]] = None, root:str = html_snapshot_dir, max_workers:Optional[int] = None) -> dict[str, Optional[dict]]:
+    """Re-run job extraction over saved job pages (all of them by default) in a process pool."""
+    uuids = uuids or HtmlSnapshotStore(root).job_uuids()
+    if not uuids:
+        return {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return dict(executor.map(parse_job_snapshot, uuids, [root] * len(uuids), chunksize=16))
+
+def record_payload_fixture(uuid:str, root:str = html_snapshot_dir, fixture_dir:str = captured_payload_fixture_dir) -> str:
+    """
+    Write the payloads saved for job `uuid` together with the job_details its saved page
+    gives through the DOM, so the payload mapping can be tested against a real response.
+    """
+    store = HtmlSnapshotStore(root)
+    fixture = {
+        "uuid" : uuid,
+        "payloads" : store.load_payloads(uuid),
+        "job_details" : parse_job_html(store.load_job(uuid)),
+    }
+    os.makedirs(fixture_dir, exist_ok=True)
+    path = os.path.join(fixture_dir, f"{uuid}.json")
+    with open(path, "w") as f:
+        json.dump(fixture, f, indent=2)
+    return path
+
+def main():
+    if sys.argv[1:2] == ["record"]:
+        for uuid in sys.argv[2:]:
+            print(f"Recorded {record_payload_fixture(uuid)}")
+        return
+    results = reparse_job_snapshots(sys.argv[1:] or None)
+    for uuid, job_details in results.items():
+        print(json.dumps({"uuid" : uuid, "job_details" : job_details}, indent=2))
+    parsed = sum(1 for job_details in results.values() if job_details)
+    print(f"Parsed {parsed}/{len(results)} job snapshots")
+
+if __name__ == "__main__":
+    main()
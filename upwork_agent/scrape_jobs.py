@@ -1,19 +1,81 @@
 from utils.job_counter import JobCounter
 from utils.constants import send_job_updates_webhook_url,upwork_url, home_url\
-    , cloudfare_challenge_div_id, send_job_updates_webhook_url_test
+    , cloudfare_challenge_div_id, send_job_updates_webhook_url_test, scrape_detail_concurrency, scrape_category_concurrency, extract_job_payloads, save_html_snapshots, \
+    watermark_keep_uuids, scrape_lookback_seconds, scrape_max_catchup_seconds, pipeline_persist_concurrency, \
+    pipeline_stats_interval, find_work_url
 from utils.session import Session
 from utils.exceptions import ScraperError, PrivateProfileError
 from utils.models import FinalJobPayload
 from utils.job_filter import JobFilter
+from utils.field_spec import extract_fields, extract_items
+from utils.html_snapshots import HtmlSnapshotStore
+from upwork_agent.job_fields import JOB_PAGE_FIELDS, build_job_details, TileFeed, SEARCH_FEED, BEST_MATCH_FEED
+from upwork_agent.job_payload import JobPayloadCapture
 from db_utils.access_db import add_job
-from db_utils.queue_manager import update_task_status
+from db_utils.seen_jobs import SeenJobIndex
+from db_utils.watermarks import get_watermarks, update_watermark
+from utils.posted_time import parse_posted_at
+from utils.pipeline import Pipeline, PipelineStage
+from db_utils.queue_manager import update_task_status, fail_task
 
 
 from nyx.page import NyxPage
+from nyx.page_pool import PagePool
 
+from typing import Optional
 import asyncio
 import traceback
-import pickle
+from datetime import datetime, timedelta, timezone
+
+class CategoryRun:
+    """
+    One feed scraped in a session. It is finished once its tiles were read and every
+    job discovered from them left the pipeline; only then, and only if nothing failed,
+    does its watermark move forward.
+    """
+    def __init__(self, session:"ScraperSession", category:str, url:Optional[str] = None, feed:TileFeed = SEARCH_FEED):
+        self.session = session
+        self.category = category
+        # No url: the feed is read from the logged in home page (Best Match tab)
+        self.url = url
+        self.feed = feed
+        self.tiles: list[dict] = []
+        self.pending = 0
+        self.discovered = False
+        self.failed = False
+        self.finished = False
+
+    async def settle(self, ok:bool):
+        self.failed |= not ok
+
+    async def discovery_done(self):
+        self.discovered = True
+        await self._maybe_finish()
+
+    async def job_settled(self, ok:bool):
+        self.pending -= 1
+        self.failed |= not ok
+        await self._maybe_finish()
+
+    async def _maybe_finish(self):
+        if self.discovered and self.pending == 0 and not self.finished:
+            self.finished = True
+            if not self.failed:
+                await self.session.advance_watermark(self)
+
+
+class JobItem:
+    """A job tile travelling through the pipeline, gathering its details on the way."""
+    def __init__(self, run:CategoryRun, tile:dict):
+        self.run = run
+        self.tile = tile
+        self.uuid = tile["uuid"]
+        self.link = upwork_url + tile["href"]
+        self.job_details: Optional[dict] = None
+
+    async def settle(self, ok:bool):
+        await self.run.job_settled(ok)
+
 
 class ScraperSession(Session):
     def __init__(
@@ -21,53 +83,68 @@ class ScraperSession(Session):
             task_id:int,
             page:NyxPage, 
             links_to_visit:dict[str, str], 
-            last_links:dict[str, str],
             username:str,
             password:str, 
             security_answer:str = None,
             status_endpoint:str = send_job_updates_webhook_url,
-            job_filter = JobFilter()
+            job_filter = JobFilter(),
+            detail_pool:Optional[PagePool] = None,
+            detail_concurrency:int = scrape_detail_concurrency,
+            search_pool:Optional[PagePool] = None,
+            category_concurrency:int = scrape_category_concurrency,
+            use_job_payloads:bool = extract_job_payloads,
+            save_snapshots:bool = save_html_snapshots,
+            seen_jobs:Optional[SeenJobIndex] = None,
+            worker_id:Optional[str] = None
         ):
-        super().__init__(task_id = task_id, page = page, username = username, password=password, security_answer=security_answer, status_endpoint=status_endpoint, payload_endpoint=status_endpoint, payload=FinalJobPayload())
+        super().__init__(task_id = task_id, page = page, username = username, password=password, security_answer=security_answer, status_endpoint=status_endpoint, payload_endpoint=status_endpoint, payload=FinalJobPayload(), worker_id=worker_id)
         self.links_to_visit = links_to_visit
         self.job_counter = JobCounter()
-        self.latest_links = last_links
-        self.session_latest_links = {}
-        self.job_details = {}
+        self.detail_visits_saved = JobCounter()
+        self.watermarks: dict[str, dict] = {}
         self.job_filter = job_filter
+        self.detail_pool = detail_pool
+        # Without a pool, feeds and job pages are opened one after the other on the session's own tab
+        self.detail_concurrency = detail_concurrency if detail_pool else 1
+        self.search_pool = search_pool
+        self.category_concurrency = category_concurrency if search_pool else 1
+        self.pipeline: Optional[Pipeline] = None
+        self.use_job_payloads = use_job_payloads
+        self.payload_extractions = JobCounter()
+        # Job pages whose payload did not map, a growing count means the payload paths are out of date
+        self.payload_fallbacks = JobCounter()
+        self.snapshot_store = HtmlSnapshotStore() if save_snapshots else None
+        self.seen_jobs = seen_jobs
+        # Jobs picked up by a category in this session, so a job listed in several categories is opened once
+        self.claimed_uuids: set[int] = set()
+        self.seen_jobs_skipped = JobCounter()
         
     async def run(self):
-        client_setup_success = await self.setup_client()
-        if not client_setup_success:
-            return False
         try:
+            self.watermarks = await get_watermarks()
             login_success = await self.login(to_scrape=True)
             if not login_success:
-                await update_task_status(self.task_id, "failed")
+                await fail_task(self.task_id, error=self.status, worker_id=self.worker_id)
                 return False
-            login_page_scraper_success = await self.scrape_login_page()
-            if not login_page_scraper_success:
-                await update_task_status(self.task_id, "failed")
+            runs = [CategoryRun(self, "Best Match", feed=BEST_MATCH_FEED)]
+            runs += [CategoryRun(self, category, url) for category, url in self.links_to_visit.items()]
+            await self.run_pipeline(runs)
+            failed_categories = [run.category for run in runs if run.failed]
+            if len(failed_categories) == len(runs):
+                self.update_status("Failed", f"Scraping failed for every category: {', '.join(failed_categories)}")
+                await self.send_status()
+                self.print_status()
+                await fail_task(self.task_id, error=self.status, worker_id=self.worker_id)
                 return False
-            for category, url in self.links_to_visit.items():
-                print(f"Visiting category: {category} - {url}")
-                job_page_visit_status = await self.visit_job_page(url)
-                if not job_page_visit_status:
-                    continue
-                job_page_scrape_status = await self.scrape_listed_jobs(category)
-                if not job_page_scrape_status:
-                    await update_task_status(self.task_id, "failed")
-                    return False
-                await asyncio.sleep(2)
-            self.update_status("Success", f"Scraping session completed. {self.job_counter.get_count()} new jobs found.")
+            self.update_status("Success", f"Scraping session completed. {self.job_counter.get_count()} new jobs found. "
+                                          f"{self.detail_visits_saved.get_count()} job page visits saved by tile filtering, "
+                                          f"{self.seen_jobs_skipped.get_count()} by skipping jobs already seen."
+                                          + (f" {self.payload_extractions.get_count()} jobs read from page payloads, {self.payload_fallbacks.get_count()} scraped from the page instead." if self.use_job_payloads else "")
+                                          + (f" Failed categories: {', '.join(failed_categories)}" if failed_categories else ""))
             await self.send_status()
             self.print_status()
-            await update_task_status(self.task_id, "Done")
-            await self.close_client()
-            with open("state_data/latest_links.pkl", "wb") as f:
-                pickle.dump(self.get_latest_links(), f)
-                print("Latest links saved to latest_links.pkl")
             await self.page.goto(home_url)
+            await update_task_status(self.task_id, "done", result={**self.status, "pipeline" : self.pipeline.stats()}, worker_id=self.worker_id)
             return True
         except Exception as e:
             print(e)
@@ -75,254 +152,278 @@ class ScraperSession(Session):
             self.update_status("Failed", f"Error in scraping session: {e}")
             await self.send_status()
             self.print_status()
-            await self.close_client()
+            await fail_task(self.task_id, error=self.status, worker_id=self.worker_id)
             await self.page.goto(home_url)
             return False
                 
-    async def scrape_job_page(self):
+    def build_pipeline(self) -> Pipeline:
+        """
+        discover (feeds) -> details (job pages) -> filter -> persist (jobs table + webhook outbox).
+        Bounded queues between the stages: tabs keep navigating while the database
+        catches up, and only slow down once the queues ahead of them are full.
+        """
+        return Pipeline([
+            PipelineStage("discover", self.discover_jobs, concurrency=self.category_concurrency),
+            PipelineStage("details", self.extract_job_details, concurrency=self.detail_concurrency),
+            PipelineStage("filter", self.filter_job),
+            PipelineStage("persist", self.persist_job, concurrency=pipeline_persist_concurrency),
+        ], on_settled=lambda item, ok: item.settle(ok))
+        
+    async def run_pipeline(self, runs:list[CategoryRun]):
+        self.pipeline = self.build_pipeline()
+        self.pipeline.start()
+        reporter = asyncio.create_task(self.pipeline.report(pipeline_stats_interval))
         try:
-            self.job_details = {}
-            
-            client_location = await self.page.get_text_content('li[data-qa="client-location"] strong')
-            self.job_details["client_location"] = client_location.strip() if client_location else "N/A"
-            
-            if self.job_details["client_location"] == "N/A":
-                self.page.take_screenshot("private_job.png")
-                raise PrivateProfileError("Private job posting or structure changed.")
-            
-            hire_rate = await self.page.get_text_content('li[data-qa="client-job-posting-stats"] div')
-            self.job_details["hire_rate"] = hire_rate.strip() if hire_rate else "N/A"
-            
-            total_spent = await self.page.get_text_content('li strong[data-qa="client-spend"] span span')
-            self.job_details["total_spent"] = total_spent.strip() if total_spent else "N/A"
-            
-            member_since = await self.page.get_text_content('li[data-qa="client-contract-date"] small')
-            self.job_details["member_since"] = member_since.strip() if member_since else "N/A"
-            
-            payment_verified = await self.page.check_for_element('div.payment-verified')
-            print(f"Payment verified: {payment_verified}")
-            self.job_details["payment_verified"] = payment_verified
-            
-            summary_element = await self.page.get_all_elements('div[data-test="Description"] p')
-            summary = ""
-            for element in summary_element:
-                summary_chunk = await self.page.get_text_content(element)
-                summary += summary_chunk.strip() + " "
-            self.job_details["summary"] = summary.strip()
-            
-            duration_type_elements = await self.page.get_all_elements('div[data-cy*="duration"]')
-            duration_elements = await self.page.get_all_elements('div[data-cy*="duration"] + strong > span')
-            duration_type = await duration_type_elements[0].get_attribute('data-cy') if duration_type_elements else None
-            duration = await self.page.get_text_content(duration_elements[0]) if duration_elements else "N/A"
-            self.job_details["duration_type"] = duration_type.strip() if duration_type else "N/A"
-            self.job_details["duration"] = duration.strip()
-            
-            price_div = await self.page.get_element('div[data-cy="fixed-price"] + div strong')
-            if price_div:
-                price = await self.page.get_text_content(price_div)
-                self.job_details["hourly_rate"] = price.strip() if price else "N/A"
-                self.job_details["job_type"] = "Fixed Price"
-            else:        
-                rate_divs = await self.page.get_all_elements('div[data-cy="clock-timelog"] + div strong')
-                rates = []
-                for div in rate_divs:
-                    rate = await self.page.get_text_content(div)
-                    rates.append(rate.strip())
-                hourly_rate = "-".join(rates)
-                self.job_details["hourly_rate"] = hourly_rate.strip() if hourly_rate else "N/A"
-                self.job_details["job_type"] = "Hourly"
-            
-            skill_elements = await self.page.get_all_elements('div.skills-list span span a div div')
-            skills = []
-            for element in skill_elements:
-                skill = await self.page.get_text_content(element)
-                skills.append(skill.strip() + "\n")
-            self.job_details["skills"] = ", ".join(skills)
-            
-            qualified = True
-            if await self.page.check_for_element('ul.qualification-items'):
-                qualification_elements = await self.page.get_all_elements('ul.qualification-items span.icons div')
-                for element in qualification_elements:
-                    qualification_status = await self.page.get_attribute(element, 'title')
-                    if qualification_status == "You do not meet this qualification":
-                        qualified = False
-                        break
-                    
-            self.job_details["qualified"] = qualified
-            
-            if await self.page.check_for_element('section[data-test="Questions"]'):
-                question_number = 1
-                questions = []
-                question_elements = await self.page.get_all_elements('section[data-test="Questions"] ol li')
-                for q_element in question_elements:
-                    question_text = await self.page.get_text_content(q_element)
-                    questions.append(str(question_number) + ". " + question_text.strip() + "\n")
-                    question_number+=1
-                self.job_details["questions"] = " ".join(questions)
-                print(self.job_details["questions"])
-            else:
-                self.job_details["questions"] = "N/A"
-            return True
-        except Exception:
+            for run in runs:
+                await self.pipeline.put(run)
+            await self.pipeline.close()
+        except BaseException:
+            await self.pipeline.cancel()
             raise
+        finally:
+            reporter.cancel()
+            print(f"Pipeline - {self.pipeline.format_stats()}")
+        
+    async def scrape_job_page(self, page:NyxPage = None):
+        page = page or self.page
+        fields = await extract_fields(page, JOB_PAGE_FIELDS)
+        if fields["client_location"] == "N/A":
+            await page.take_screenshot("private_job.png")
+            raise PrivateProfileError("Private job posting or structure changed.")
+        job_details = build_job_details(fields)
+        print(f"Payment verified: {job_details['payment_verified']}")
+        return job_details
+        
+    async def save_snapshot(self, page:NyxPage, uuid = None, category:str = None):
+        """Keep the rendered HTML of a job page (by uuid) or of a feed (by category) for the offline parser."""
+        if not self.snapshot_store:
+            return
+        try:
+            html = await page.content()
+            if uuid is not None:
+                await asyncio.to_thread(self.snapshot_store.save_job, uuid, html)
+            else:
+                await asyncio.to_thread(self.snapshot_store.save_feed, category, html)
+        except Exception as e:
+            print(f"Warning: Could not save HTML snapshot: {e}")
+        
+    async def save_payloads(self, uuid, payloads:list):
+        """Keep the payloads read on a job page next to its snapshot, see offline_parser.record_payload_fixture."""
+        if not self.snapshot_store or not payloads:
+            return
+        try:
+            await asyncio.to_thread(self.snapshot_store.save_payloads, uuid, payloads)
+        except Exception as e:
+            print(f"Warning: Could not save job payloads: {e}")
+        
+    async def fetch_job_details(self, link:str, uuid = None):
+        """
+        Open `link` directly on a free tab and scrape it. Returns the job details, or None
+        for a private job. Any other failure raises, so the job's category is not marked done.
+        """
+        page = await self.detail_pool.get_idle_page() if self.detail_pool else self.page
+        capture = JobPayloadCapture(page) if self.use_job_payloads else None
+        try:
+            if capture:
+                capture.start()
+            await page.goto(link, wait_for='li[data-qa="client-location"] strong', captcha_selector=cloudfare_challenge_div_id, wait_until="domcontentloaded", referer=upwork_url)
+            if self.check_login_redirect(page):
+                raise ScraperError("Redirected to the login page", context={"url" : link})
+            if uuid is not None:
+                await self.save_snapshot(page, uuid=uuid)
+            if capture:
+                job_details = await capture.extract()
+                if uuid is not None:
+                    await self.save_payloads(uuid, capture.captured)
+                if job_details:
+                    self.payload_extractions.increment()
+                    return job_details
+                self.payload_fallbacks.increment()
+                print(f"No usable job payload, scraping the page instead - {link}")
+            return await self.scrape_job_page(page)
+        except PrivateProfileError:
+            await self.send_status("Failed", f"Private job posting or structure changed.\nSkipping job {link}")
+            self.print_status()
+            return None
+        except Exception as e:
+            await self.send_status("Failed", f"Error scraping job page: {e}\nSkipping job {link}")
+            self.print_status()
+            raise ScraperError(f"Error scraping job page: {e}", context={"url" : link}) from e
+        finally:
+            if capture:
+                capture.stop()
+            if self.detail_pool:
+                # The next goto replaces whatever is loaded, no need to park the tab
+                await self.detail_pool.release(page, reset=False)
         
-    async def visit_job_page(self, link:str):
+    async def discover_jobs(self, run:CategoryRun, emit):
+        """
+        Pipeline stage: read a feed on its own tab and emit the tiles worth opening.
+        A failure is reported and confined to the category: its watermark is left
+        untouched and the other categories carry on.
+        """
         try:
-            await self.page.goto(link,wait_for = 'section[data-test="JobsList"]', captcha_selector=cloudfare_challenge_div_id,wait_until= "domcontentloaded",referer=upwork_url)
+            fresh_tiles = await self.read_feed(run)
+            if fresh_tiles is None:
+                run.failed = True
+                return
+            for tile in await self.select_tiles_to_visit(fresh_tiles):
+                run.pending += 1
+                await emit(JobItem(run, tile))
+        except Exception as e:
+            traceback.print_exc()
+            await self.send_status("Failed", f"Error scraping category {run.category}: {e}")
+            self.print_status()
+            run.failed = True
+        finally:
+            await run.discovery_done()
+        
+    async def read_feed(self, run:CategoryRun):
+        """Open the feed of `run` and return its fresh tiles, None when the feed could not be read."""
+        if run.url is None:
+            page = self.page
+        else:
+            page = await self.search_pool.get_idle_page() if self.search_pool else self.page
+        try:
+            if run.url is None:
+                if not await self.open_best_match(page):
+                    return None
+            else:
+                print(f"Visiting category: {run.category} - {run.url}")
+                if not await self.visit_job_page(run.url, page) or self.check_login_redirect(page):
+                    return None
+            await self.save_snapshot(page, category=run.category)
+            run.tiles = await extract_items(page, run.feed.tile_selector, run.feed.fields)
+        finally:
+            if run.url is not None and self.search_pool:
+                await self.search_pool.release(page, reset=False)
+        fresh_tiles = self.select_fresh_tiles(run.tiles, run.category)
+        if fresh_tiles is None:
+            await self.send_status("Failed", "Problem extracting link ... \nMaybe the website structure has changed")
+            self.print_status()
+        return fresh_tiles
+        
+    async def visit_job_page(self, link:str, page:NyxPage = None):
+        page = page or self.page
+        try:
+            await page.goto(link,wait_for = 'section[data-test="JobsList"]', captcha_selector=cloudfare_challenge_div_id,wait_until= "domcontentloaded",referer=upwork_url)
         except Exception as e:
             self.update_status("Failed", f"Error visiting job page: {e}")
             # await self.send_status()
             # self.print_status()
-            await self.page.goto(home_url)
+            await page.goto(home_url)
             return False
         return True
     
-    async def scrape_listed_jobs(self, category:str = "category1"):
-        first_link = True
-        job_postings = await self.page.get_all_elements(selector='article[data-test="JobTile"]')
-        for job_posting in job_postings:
-            try:
-                job_posted_time_elements = await job_posting.query_selector_all('small[data-test="job-pubilshed-date"] span')
-            except Exception as e:
-                print(f"Error getting job posted time elements: {e}")
-                continue
-            job_posted_time = ""
-            for element in job_posted_time_elements:
-                job_posted_time += await self.page.get_text_content(element) + " "
-            job_posted_time = job_posted_time.strip()
-            print(f"Job posted time: {job_posted_time}")
-            link_div = await job_posting.query_selector('a[data-test="job-tile-title-link UpLink"]')
-            link = await link_div.get_attribute('href')
-            uuid = await link_div.get_attribute('data-ev-job-uid')
-            uuid = int(uuid) if uuid and uuid.isdigit() else None
-            if not link:
-                self.send_status("Failed", "Problem extracting link ... \nMaybe the website structure has changed")
-                self.print_status()
-                return False
-            link = upwork_url + link
-            if first_link:
-                self.session_latest_links[category] = uuid
-                print(f"Setting latest link for {category}: {link}")
-                print(  self.session_latest_links )
-                first_link = False
-            
-            print(f"{uuid} === {self.latest_links.get(category,None)}")
-            if uuid == self.latest_links.get(category,None) or \
-                    (("minutes" not in job_posted_time.lower().split(sep=" ") and "minute" not in job_posted_time.lower().split(sep=" ")) \
-                        and ("seconds" not in job_posted_time.lower().split(sep=" ") and "second" not in job_posted_time.lower().split(sep=" "))):
-                print(f"last_link in {category}")
-                if uuid == self.latest_links.get(category,None):
-                    print("Exact link match found, stopping further scraping.")
-                break
-            try:
-                await self.page.click(link_div, wait_for='li[data-qa="client-location"] strong')
-            except Exception as e:
-                self.send_status("Failed",f"{e}")
-                self.print_status()
-                continue
-            
-            try:
-                scrape_success = await self.scrape_job_page()
-            except PrivateProfileError:
-                self.send_status("Failed", f"Private job posting or structure changed.\nSkipping job {link}")
-                self.print_status()
+    async def select_tiles_to_visit(self, fresh_tiles:list[dict]) -> list[dict]:
+        """Drop the tiles of jobs already seen and the ones the tile filter rejects."""
+        known_uuids = await self.seen_jobs.known([tile["uuid"] for tile in fresh_tiles]) if self.seen_jobs else set()
+        tiles_to_visit = []
+        for tile in fresh_tiles:
+            if tile["uuid"] in known_uuids or tile["uuid"] in self.claimed_uuids:
+                print(f"Job already seen - {upwork_url + tile['href']}")
+                self.seen_jobs_skipped.increment()
                 continue
-            except Exception as e:
-                self.send_status("Failed", f"Error scraping job page: {e}\nSkipping job {link}")
-                self.print_status()
+            if not self.job_filter.is_tile_allowed(tile):
+                print(f"Job filtered out from its tile - {upwork_url + tile['href']}")
+                self.detail_visits_saved.increment()
                 continue
-                
-            post_processing_success = await self.post_scraping_tasks(uuid = uuid, link = link, category = category)
-            if not post_processing_success:
-                return False
-            await asyncio.sleep(2)
-            await self.page.go_back()
-            await asyncio.sleep(2)
-        return True
+            if tile["uuid"] is not None:
+                self.claimed_uuids.add(tile["uuid"])
+            tiles_to_visit.append(tile)
+        return tiles_to_visit
     
-    async def post_scraping_tasks(self, uuid:int, link:str, category:str):
-        if not self.job_filter.is_job_allowed(self.job_details):
+    async def advance_watermark(self, run:CategoryRun):
+        """Record the top of a fully processed feed as the category's new watermark."""
+        if not run.tiles:
+            return
+        posted_times = [tile["posted_at"] for tile in run.tiles[:watermark_keep_uuids] if tile.get("posted_at")]
+        watermark_status, msg = await update_watermark(run.category, [tile["uuid"] for tile in run.tiles], max(posted_times, default=None))
+        if not watermark_status:
+            await self.send_status("Failed", msg)
+            self.print_status()
+    
+    def scrape_cutoff(self, category:str, now:datetime) -> datetime:
+        """Jobs posted before this are not looked at: the lookback window, stretched back to the last scrape of the category."""
+        cutoff = now - timedelta(seconds=scrape_lookback_seconds)
+        last_posted_at = self.watermarks.get(category, {}).get("posted_at")
+        if last_posted_at and last_posted_at < cutoff:
+            cutoff = max(last_posted_at, now - timedelta(seconds=scrape_max_catchup_seconds))
+        return cutoff
+    
+    def select_fresh_tiles(self, tiles:list[dict], category:str):
+        """
+        Decide, before any click, which tiles of a feed are new since the last session:
+        everything above the first job already recorded in the category's watermark
+        that was posted after the scrape cutoff.
+        Returns None when a tile has no link (the page structure probably changed).
+        """
+        now = datetime.now(timezone.utc)
+        cutoff = self.scrape_cutoff(category, now)
+        seen_uuids = set(self.watermarks.get(category, {}).get("recent_uuids", []))
+        for tile in tiles:
+            tile["posted_at"] = parse_posted_at(tile["posted_text"], now)
+        fresh_tiles = []
+        for tile in tiles:
+            if not tile["href"]:
+                return None
+            print(f"Job posted time: {tile['posted_text']}")
+            if tile["uuid"] in seen_uuids:
+                print(f"Watermark reached in {category}, stopping further scraping.")
+                break
+            # Unreadable posted text counts as old, as the site structure probably changed
+            if tile["posted_at"] is None or tile["posted_at"] < cutoff:
+                print(f"Jobs in {category} older than {cutoff.isoformat()}, stopping further scraping.")
+                break
+            fresh_tiles.append(tile)
+        return fresh_tiles
+    
+    async def extract_job_details(self, job:JobItem, emit):
+        """
+        Pipeline stage: open the job page and read its details. A private job is dropped,
+        a page that could not be read raises and keeps the category's watermark where it was.
+        """
+        job.job_details = await self.fetch_job_details(job.link, uuid=job.uuid)
+        if job.job_details is not None:
+            await emit(job)
+        
+    async def filter_job(self, job:JobItem, emit):
+        """Pipeline stage: keep the jobs passing the full job filter."""
+        if not self.job_filter.is_job_allowed(job.job_details):
             print("Job filtered out based on criteria.")
-            return True
-        job_update_status, msg = await add_job(uuid=uuid, job_url=link,job_description=self.job_details)
+            return
+        await emit(job)
+        
+    async def persist_job(self, job:JobItem, emit):
+        """
+        Pipeline stage: store the job together with its webhook notification, which
+        the WebhookDispatcher delivers in the background.
+        """
+        payload = FinalJobPayload(status="Done", category=job.run.category, url=job.link, job_details=job.job_details)
+        job_update_status, msg = await add_job(uuid=job.uuid, job_url=job.link,job_description=job.job_details, outbox_event=(self.payload_endpoint, payload.model_dump()))
+        if job_update_status and self.seen_jobs:
+            self.seen_jobs.add(job.uuid)
         if job_update_status and msg["status"] == "Exists":
-            print(f"Job already exists in db - {link}")
-            return True
+            print(f"Job already exists in db - {job.link}")
+            return
         elif not job_update_status:
             await self.send_status("Failed", f"Database update error - {msg}")
             self.print_status()
-            return False
-        else:
-            self.payload.status = "Done"
-            self.payload.category = category
-            self.payload.url = link
-            self.payload.job_details = self.job_details
-            
-            sent_status = await self.send_payload()
-            if not sent_status:
-                await self.send_status()
-                self.print_status()
-                return False
-            else:
-                self.job_counter.increment()
-                print(f"Job {self.job_counter.get_count()} ------ {self.job_details}")  
-                return True     
+            raise ScraperError(f"Database update error - {msg}", context={"url" : job.link})
+        self.job_counter.increment()
+        print(f"Job {self.job_counter.get_count()} ------ {job.job_details}")
         
-    async def scrape_login_page(self):
-        best_match_button = await self.page.get_element('button[data-test="tab-best-matches"]')
-        if best_match_button:
-            await self.page.click(best_match_button)
-            await asyncio.sleep(1)
-            job_tiles = await self.page.get_all_elements('section[data-ev-sublocation="job_feed_tile"]')
-            first_link = True
-            for job_posting in job_tiles:
-                job_posted_time_element = await job_posting.query_selector('span[data-test="posted-on"]')
-                job_posted_time = await self.page.get_text_content(job_posted_time_element) if job_posted_time_element else "N/A"
-                print(f"Job posted time: {job_posted_time.strip()}")
-                link_div = await job_posting.query_selector('a[data-ev-label="link"]')
-                link = await link_div.get_attribute('href')
-                uuid = await link_div.get_attribute('data-ev-opening_uid')
-                uuid = int(uuid) if uuid and uuid.isdigit() else None
-                if not link:
-                    await self.send_status("Failed", "Problem extracting link ... \nMaybe the website structure has changed")
-                    self.print_status()
-                    return False
-                link = upwork_url + link
-                if first_link:
-                    self.session_latest_links["Best Match"] = uuid
-                    first_link = False
-                if uuid == self.latest_links.get("Best Match",None) or \
-                    (("minutes" not in job_posted_time.lower().split(sep=" ") and "minute" not in job_posted_time.lower().split(sep=" ")) \
-                        and ("seconds" not in job_posted_time.lower().split(sep=" ") and "second" not in job_posted_time.lower().split(sep=" "))):
-                    print(f"last_link in Best Match")
-                    if uuid == self.latest_links.get("Best Match",None):
-                        print("Exact link match found, stopping further scraping.")
-                    break
-                try:
-                    await self.page.click(link_div, wait_for='li[data-qa="client-location"] strong')
-                except Exception as e:
-                    self.send_status("Failed",f"Error clicking job link: {e}")
-                    continue
-                try:
-                    scrape_success = await self.scrape_job_page()
-                except PrivateProfileError:
-                    self.send_status("Failed", f"Private job posting or structure changed.\nSkipping job {link}")
-                    self.print_status()
-                    continue
-                except Exception as e:
-                    self.send_status("Failed", f"Error scraping job page: {e}\nSkipping job {link}")
-                    self.print_status()
-                    continue
-                
-                post_scraping_success = await self.post_scraping_tasks(uuid, link, "Best Match")
-                if not post_scraping_success:
-                    return False
-                await asyncio.sleep(2)
-                await self.page.go_back()
-                await asyncio.sleep(2)
-        else:
-            self.send_status("Failed", "Best Match tab not found on login page.")
-        return True             
-                
-    def get_latest_links(self):
-        return self.session_latest_links
\ No newline at end of file
+    async def open_best_match(self, page:NyxPage) -> bool:
+        best_match_selector = 'button[data-test="tab-best-matches"]'
+        best_match_button = await page.get_element(best_match_selector)
+        if not best_match_button:
+            # A still valid login skips the login page, so the feed is not open yet
+            await page.goto(find_work_url, captcha_selector=cloudfare_challenge_div_id, wait_for=best_match_selector, wait_until="domcontentloaded", referer=upwork_url)
+            best_match_button = await page.get_element(best_match_selector)
+        if not best_match_button:
+            self.check_login_redirect(page)
+            await self.send_status("Failed", "Best Match tab not found on the find work page.")
+            return False
+        await page.click(best_match_button)
+        await asyncio.sleep(1)
+        return True
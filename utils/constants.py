@@ -13,4 +13,151 @@ upwork_login_url = "https://www.upwork.com/ab/account-security/login"
 proposals_db_name = "proposals"
 
 send_job_updates_webhook_url_test = "https://264f935563a3.ngrok-free.app/webhook-test/send_job_updates"
-send_job_updates_webhook_url = "http://n8n:5678/webhook/send_job_updates"
\ No newline at end of file
+send_job_updates_webhook_url = "http://n8n:5678/webhook/send_job_updates"
+
+task_queue_channel = "task_queue_new_task"
+worker_fallback_poll_interval = 60  # seconds, safety net in case a NOTIFY is missed
+task_lease_seconds = 120  # how long a claimed task stays reserved without a heartbeat
+task_heartbeat_interval = 30
+lease_reaper_interval = 60
+
+# Worker lanes - browser lanes get one tab per concurrent task
+browser_lane_concurrency = 2
+llm_lane_concurrency = 8
+
+# Retries - delay before attempt n is roughly retry_backoff_base * 2**(n-1), capped and jittered
+default_max_attempts = 3
+retry_backoff_base = 30  # seconds
+retry_backoff_cap = 1800
+
+# Finished tasks older than this are moved to the partitioned task_queue_history table
+task_archive_after_days = 7
+task_archive_interval = 3600  # seconds
+task_archive_batch_size = 1000
+task_status_channel = "task_queue_status"
+
+# Scheduling - within a task type, every `aging_seconds` a task waits adds 1 to its priority,
+# between task types the queue is shared in proportion to `weight`
+default_task_aging_seconds = 600
+task_type_scheduling = {
+    "check_for_jobs" : {"weight" : 1, "aging_seconds" : 600},
+    "apply_for_job" : {"weight" : 2, "aging_seconds" : 300},
+    "generate_proposal" : {"weight" : 2, "aging_seconds" : 300},
+    "apply_batch" : {"weight" : 2, "aging_seconds" : 300},
+}
+queue_stats_window_hours = 24
+
+# Wall-clock limit for one run of a task, after which it is cancelled and recorded as timed_out
+default_task_deadline = 900  # seconds
+task_type_deadlines = {
+    "check_for_jobs" : 1800,
+    "apply_for_job" : 600,
+    "generate_proposal" : 300,
+    "apply_batch" : 1800,
+}
+task_cancel_channel = "task_queue_cancel"
+
+# Sweeping task types coalesce on their type: at most one pending task, which may queue behind
+# a running one so that a trigger arriving mid-run is not lost
+coalescing_task_types = ["check_for_jobs", "apply_batch"]
+
+# Job detail pages are opened in parallel on a dedicated pool of tabs
+detail_page_pool_size = 4
+scrape_detail_concurrency = 4
+
+# Search categories are scraped in parallel, each on its own tab
+search_page_pool_size = 3
+scrape_category_concurrency = 3
+
+# Requests aborted on scrape tabs (page pools created with a RouteBlocklist)
+scrape_blocked_resource_types = ["image", "media", "font"]
+scrape_blocked_url_patterns = [
+    r"google-analytics\.com",
+    r"googletagmanager\.com",
+    r"doubleclick\.net",
+    r"facebook\.(net|com)/.*(tr|fbevents)",
+    r"hotjar\.com",
+    r"segment\.(io|com)",
+    r"bat\.bing\.com",
+    r"cdn\.optimizely\.com",
+    r"sentry(-cdn)?\.io",
+]
+# Never blocked, the Cloudflare challenge must load completely
+scrape_allowed_url_patterns = [
+    r"challenges\.cloudflare\.com",
+]
+# Rough transfer size of a blocked request, by resource type, used to estimate the bytes saved
+resource_size_estimates = {
+    "image" : 40_000,
+    "media" : 500_000,
+    "font" : 30_000,
+    "script" : 60_000,
+    "stylesheet" : 30_000,
+    "other" : 5_000,
+}
+
+# Read job details from the data the job page already receives instead of its markup (DOM scraping stays the fallback)
+extract_job_payloads = False
+# API responses of a job page carrying its details, captured with page.on("response")
+job_payload_url_patterns = [
+    r"/api/graphql/v1.*(jobAuthDetails|jobPubDetails)",
+    r"/job-details/jobdetails/api/job/",
+]
+# Where the job page keeps the same data in its embedded Nuxt state
+job_payload_state_path = "state.jobDetails"
+
+# Rendered HTML of feeds and job pages, zstd-compressed, for the offline parser
+save_html_snapshots = False
+html_snapshot_dir = "state_data/html_snapshots"
+html_snapshot_compression_level = 10
+# Job payloads recorded with their DOM job_details, checked by tests/test_job_payload.py
+captured_payload_fixture_dir = "tests/fixtures/captured"
+
+# Seen job index: an exact set up to this many jobs, a Bloom filter above it
+seen_index_bloom_threshold = 1_000_000
+seen_index_false_positive_rate = 0.001
+
+# Incremental crawling: a category feed is read down to the first job seen before,
+# or to jobs posted longer ago than the lookback window (further back, up to the
+# catch-up limit, when the last scrape of the category is older than that)
+watermark_keep_uuids = 20
+scrape_lookback_seconds = 3600
+scrape_max_catchup_seconds = 86400
+
+# Scraping pipeline (discover -> details -> filter -> persist)
+pipeline_queue_size = 32
+pipeline_persist_concurrency = 2
+pipeline_stats_interval = 30
+
+# Webhook outbox: events are written to postgres and delivered by the WebhookDispatcher
+outbox_channel = "webhook_outbox_new"
+outbox_batch_size = 50
+outbox_dispatch_concurrency = 8
+outbox_lease_seconds = 60
+outbox_max_attempts = 10
+outbox_retry_base = 5
+outbox_retry_cap = 600
+outbox_fallback_poll_interval = 30
+outbox_keep_delivered_days = 7
+
+# Process-wide HTTP client (webhooks and sessions), created in the app lifespan
+http_max_connections = 20
+http_max_keepalive_connections = 10
+http_keepalive_expiry = 30
+http_connect_timeout = 5
+http_read_timeout = 30
+http_write_timeout = 30
+http_pool_timeout = 10
+# Needs the h2 package (pip install "httpx[http2]"), falls back to HTTP/1.1 keep-alive without it
+http_use_http2 = False
+
+# Login state of the shared browser profile: a login verified on a page is trusted for the TTL
+# while the context keeps its session cookies, after that the login page flow checks it again
+login_state_ttl = 600
+login_cookie_names = ["master_access_token", "oauth2_global_js_token"]
+find_work_url = "https://www.upwork.com/nx/find-work/best-matches"
+
+# apply_batch claims up to apply_batch_max_jobs pending apply_for_job tasks and works through them
+# in one session; its tabs load the next bidding page while the current form is being filled
+apply_batch_max_jobs = 10
+apply_batch_page_pool_size = 2
@@ -0,0 +1,87 @@
+from typing import Any, Callable, Optional
+
+from utils.js_scripts import get_field_extraction_script, get_item_extraction_script
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+class FieldSpec:
+    """
+    Declarative description of one field to pull out of a page.
+
+    name      : key of the field in the result
+    selector  : CSS selector
+    mode      : text | texts | attr | attrs | exists (see get_field_extraction_script)
+    attribute : attribute name for the attr / attrs modes
+    post      : optional function applied to the raw value in Python
+    """
+    MODES = {"text", "texts", "attr", "attrs", "exists"}
+
+    def __init__(self, name:str, selector:str, mode:str = "text", attribute:Optional[str] = None, post:Optional[Callable[[Any], Any]] = None):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown extraction mode '{mode}' for field '{name}'")
+        if mode in ("attr", "attrs") and not attribute:
+            raise ValueError(f"Field '{name}' needs an attribute for mode '{mode}'")
+        self.name = name
+        self.selector = selector
+        self.mode = mode
+        self.attribute = attribute
+        self.post = post
+
+    def to_js(self) -> dict:
+        return {"name" : self.name, "selector" : self.selector, "mode" : self.mode, "attribute" : self.attribute}
+
+    def process(self, raw_value):
+        return self.post(raw_value) if self.post else raw_value
+
+
+def compile_field_specs(specs:list[FieldSpec]) -> list[dict]:
+    return [spec.to_js() for spec in specs]
+
+async def extract_fields(page, specs:list[FieldSpec]) -> dict:
+    """Extract every field in `specs` from `page` with a single page.evaluate round trip."""
+    raw = await page.evaluate(get_field_extraction_script(), compile_field_specs(specs))
+    return {spec.name : spec.process(raw.get(spec.name)) for spec in specs}
+
+async def extract_items(page, item_selector:str, specs:list[FieldSpec]) -> list[dict]:
+    """
+    Extract `specs` inside every element matching `item_selector` (selectors are
+    relative to the item) with a single page.evaluate round trip.
+    """
+    raw_items = await page.evaluate(get_item_extraction_script(), {"item_selector" : item_selector, "specs" : compile_field_specs(specs)})
+    return [{spec.name : spec.process(raw.get(spec.name)) for spec in specs} for raw in raw_items]
+
+
+def _extract_from_node(root, specs:list[FieldSpec]) -> dict:
+    """Python counterpart of extractSpecs in js_scripts, over a selectolax node."""
+    result = {}
+    for spec in specs:
+        if spec.mode == "text":
+            node = root.css_first(spec.selector)
+            raw = node.text(deep=True) if node else None
+        elif spec.mode == "texts":
+            raw = [node.text(deep=True) for node in root.css(spec.selector)]
+        elif spec.mode == "attr":
+            node = root.css_first(spec.selector)
+            raw = node.attributes.get(spec.attribute) if node else None
+        elif spec.mode == "attrs":
+            raw = [node.attributes.get(spec.attribute) for node in root.css(spec.selector)]
+        else:
+            raw = root.css_first(spec.selector) is not None
+        result[spec.name] = spec.process(raw)
+    return result
+
+def _html_parser(html:str):
+    if LexborHTMLParser is None:
+        raise RuntimeError("selectolax is required to parse saved HTML, install it with `pip install selectolax`")
+    return LexborHTMLParser(html)
+
+def parse_fields(html:str, specs:list[FieldSpec]) -> dict:
+    """Same as extract_fields, but over saved HTML instead of a live page."""
+    return _extract_from_node(_html_parser(html), specs)
+
+def parse_items(html:str, item_selector:str, specs:list[FieldSpec]) -> list[dict]:
+    """Same as extract_items, but over saved HTML instead of a live page."""
+    return [_extract_from_node(item, specs) for item in _html_parser(html).css(item_selector)]
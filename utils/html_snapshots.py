@@ -0,0 +1,77 @@
+import os
+import json
+import re
+from datetime import datetime, timezone
+from typing import Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from utils.constants import html_snapshot_dir, html_snapshot_compression_level
+
+class HtmlSnapshotStore:
+    """
+    Rendered HTML saved to disk, zstd-compressed:
+        <root>/jobs/<uuid>.html.zst                      one job page per job uuid
+        <root>/feeds/<category>/<timestamp>.html.zst     one tile list per scrape of a category
+        <root>/payloads/<uuid>.json.zst                  job details payloads read on the job page
+    """
+    def __init__(self, root:str = html_snapshot_dir, level:int = html_snapshot_compression_level):
+        if zstandard is None:
+            raise RuntimeError("zstandard is required for HTML snapshots, install it with `pip install zstandard`")
+        self.root = root
+        self.level = level
+
+    def job_path(self, uuid) -> str:
+        return os.path.join(self.root, "jobs", f"{uuid}.html.zst")
+
+    def feed_path(self, category:str, taken_at:Optional[datetime] = None) -> str:
+        taken_at = taken_at or datetime.now(timezone.utc)
+        category_dir = re.sub(r"[^A-Za-z0-9_-]+", "_", category).strip("_") or "category"
+        return os.path.join(self.root, "feeds", category_dir, f"{taken_at.strftime('%Y%m%dT%H%M%S%f')}.html.zst")
+
+    def write(self, path:str, html:str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        compressed = zstandard.ZstdCompressor(level=self.level).compress(html.encode("utf-8"))
+        # Write then rename, so a reader never sees half a snapshot
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(compressed)
+        os.replace(tmp_path, path)
+
+    def read(self, path:str) -> str:
+        with open(path, "rb") as f:
+            return zstandard.ZstdDecompressor().decompress(f.read()).decode("utf-8")
+
+    def save_job(self, uuid, html:str) -> str:
+        path = self.job_path(uuid)
+        self.write(path, html)
+        return path
+
+    def load_job(self, uuid) -> str:
+        return self.read(self.job_path(uuid))
+
+    def save_feed(self, category:str, html:str) -> str:
+        path = self.feed_path(category)
+        self.write(path, html)
+        return path
+
+    def payload_path(self, uuid) -> str:
+        return os.path.join(self.root, "payloads", f"{uuid}.json.zst")
+
+    def save_payloads(self, uuid, payloads:list) -> str:
+        path = self.payload_path(uuid)
+        self.write(path, json.dumps(payloads, default=str))
+        return path
+
+    def load_payloads(self, uuid) -> list:
+        return json.loads(self.read(self.payload_path(uuid)))
+
+    def job_uuids(self) -> list[str]:
+        """uuids of every saved job page."""
+        jobs_dir = os.path.join(self.root, "jobs")
+        if not os.path.isdir(jobs_dir):
+            return []
+        return sorted(name[:-len(".html.zst")] for name in os.listdir(jobs_dir) if name.endswith(".html.zst"))
@@ -0,0 +1,23 @@
+from httpx import AsyncClient, Limits, Timeout
+
+from utils.constants import http_max_connections, http_max_keepalive_connections, http_keepalive_expiry, http_connect_timeout, \
+    http_read_timeout, http_write_timeout, http_pool_timeout, http_use_http2
+
+def create_http_client(
+        max_connections:int = http_max_connections,
+        max_keepalive_connections:int = http_max_keepalive_connections,
+        keepalive_expiry:float = http_keepalive_expiry,
+        connect_timeout:float = http_connect_timeout,
+        read_timeout:float = http_read_timeout,
+        write_timeout:float = http_write_timeout,
+        pool_timeout:float = http_pool_timeout,
+        http2:bool = http_use_http2,
+    ) -> AsyncClient:
+    """The long lived, connection pooling client shared by every session of the process."""
+    limits = Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections, keepalive_expiry=keepalive_expiry)
+    timeout = Timeout(connect=connect_timeout, read=read_timeout, write=write_timeout, pool=pool_timeout)
+    try:
+        return AsyncClient(limits=limits, timeout=timeout, http2=http2)
+    except ImportError as e:
+        print(f"HTTP/2 unavailable ({e}), using HTTP/1.1 keep-alive")
+        return AsyncClient(limits=limits, timeout=timeout)
@@ -62,6 +62,31 @@ class JobFilter:
             print(f"Error in get_total_spent: {e}")
             return None
     
+    def is_tile_allowed(self, tile: Dict) -> bool:
+        """
+        Cheap pre-check on what a feed tile already shows, before opening the job page.
+        Only rejects on data that is present and would also fail is_job_allowed;
+        anything missing from the tile is left for the full check.
+        """
+        try:
+            payment_status = tile.get("payment_status")
+            if payment_status and "unverified" in payment_status.lower():
+                return False
+            # The snippet is the start of the description, which is all is_job_allowed searches;
+            # the title is not, so a keyword in the title alone must not reject the job here
+            snippet = tile.get("snippet")
+            if snippet and self.avoid_keywords(snippet):
+                return False
+            total_spent_str = tile.get("total_spent")
+            if total_spent_str:
+                total_spent = self.get_total_spent(total_spent_str)
+                if total_spent is not None and not self.check_min_spent(total_spent):
+                    return False
+            return True
+        except Exception as e:
+            print(f"Error in is_tile_allowed: {e}")
+            return True
+    
     def is_job_allowed(self, job_details: Dict) -> bool:
         """Check if the job is allowed based on the title and description."""
         try:
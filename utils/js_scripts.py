@@ -42,5 +42,88 @@ def get_cursor_tracking_script(x, y) -> str:
     }})();
     """
 
+# Shared by the field extraction scripts: extracts `specs` relative to `root`
+_EXTRACT_SPECS_JS = """
+    const extractSpecs = (root, specs) => {
+        const result = {};
+        for (const spec of specs) {
+            switch (spec.mode) {
+                case 'text': {
+                    const el = root.querySelector(spec.selector);
+                    result[spec.name] = el ? el.textContent : null;
+                    break;
+                }
+                case 'texts':
+                    result[spec.name] = Array.from(root.querySelectorAll(spec.selector), el => el.textContent);
+                    break;
+                case 'attr': {
+                    const el = root.querySelector(spec.selector);
+                    result[spec.name] = el ? el.getAttribute(spec.attribute) : null;
+                    break;
+                }
+                case 'attrs':
+                    result[spec.name] = Array.from(root.querySelectorAll(spec.selector), el => el.getAttribute(spec.attribute));
+                    break;
+                case 'exists':
+                    result[spec.name] = root.querySelector(spec.selector) !== null;
+                    break;
+                default:
+                    result[spec.name] = null;
+            }
+        }
+        return result;
+    };
+"""
+
+def get_field_extraction_script() -> str:
+    """
+    Returns a JS function that takes a list of field specs
+    ({name, selector, mode, attribute}) and extracts all of them in one pass.
+    Modes: text / texts (textContent of the first / every match),
+    attr / attrs (attribute of the first / every match), exists (bool).
+    Missing single values come back as null, missing lists as [].
+    """
+    return f"""
+    (specs) => {{
+        {_EXTRACT_SPECS_JS}
+        return extractSpecs(document, specs);
+    }}
+    """
+
+def get_item_extraction_script() -> str:
+    """
+    Returns a JS function that takes {item_selector, specs} and runs the field
+    extraction inside every element matching item_selector (e.g. every job tile
+    of a feed), returning one result object per item in document order.
+    """
+    return f"""
+    ({{item_selector, specs}}) => {{
+        {_EXTRACT_SPECS_JS}
+        return Array.from(document.querySelectorAll(item_selector), item => extractSpecs(item, specs));
+    }}
+    """
+
+def get_embedded_state_script() -> str:
+    """
+    Returns a JS function that takes a dotted path (e.g. "state.jobDetails") and
+    returns that part of the page's embedded Nuxt state as plain JSON, or null
+    when the page has no such state.
+    """
+    return """
+    (path) => {
+        let value = window.__NUXT__;
+        for (const key of path.split(".")) {
+            if (value === undefined || value === null) return null;
+            value = value[key];
+        }
+        if (value === undefined || value === null) return null;
+        try {
+            return JSON.parse(JSON.stringify(value));
+        } catch (e) {
+            return null;
+        }
+    }
+    """
+
 if __name__== "__main__":
     print(generate_cursor_tracking_script(200, 300))
\ No newline at end of file
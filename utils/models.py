@@ -29,4 +29,14 @@ class FinalJobPayload(BaseModel):
     status: str = Field("", description="status")
     category: str = Field("", description="category")
     url: str = Field("", description="job url")
-    job_details: dict = Field(default_factory=dict, description="job details")
\ No newline at end of file
+    job_details: dict = Field(default_factory=dict, description="job details")
+    
+class TaskRequest(BaseModel):
+    task_type: str = Field(..., description="Type of the task, e.g. check_for_jobs or apply_for_job")
+    payload: Optional[dict] = Field(None, description="Task payload, e.g. {\"job_url\": ...}")
+    priority: int = Field(0, description="Higher priority tasks are claimed first")
+    max_attempts: Optional[int] = Field(None, ge=1, description="Attempts before the task moves to dead")
+    dedupe_key: Optional[str] = Field(None, description="Live tasks with the same key are coalesced")
+    
+class BulkEnqueueRequest(BaseModel):
+    tasks: List[TaskRequest] = Field(..., min_length=1, description="Tasks to enqueue in one transaction")
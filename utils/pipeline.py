@@ -0,0 +1,133 @@
+import asyncio
+import time
+import traceback
+from typing import Any, Awaitable, Callable, Optional
+
+from utils.constants import pipeline_queue_size
+
+_DONE = object()
+
+StageHandler = Callable[[Any, Callable[[Any], Awaitable[None]]], Awaitable[None]]
+
+class PipelineStage:
+    """
+    One step of a Pipeline: `concurrency` workers taking items from a bounded queue.
+    The handler is called as `await handler(item, emit)` and passes zero or more
+    items to the next stage with `await emit(next_item)`. A full queue downstream
+    makes emit wait, which is what slows a faster stage down to the pace of the next.
+    """
+    def __init__(self, name:str, handler:StageHandler, concurrency:int = 1, queue_size:int = pipeline_queue_size):
+        self.name = name
+        self.handler = handler
+        self.concurrency = concurrency
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.next_stage: Optional["PipelineStage"] = None
+        self.workers: list[asyncio.Task] = []
+        self.busy = 0
+        self.processed = 0
+        self.emitted = 0
+        self.dropped = 0
+        self.failed = 0
+        self.started_at: Optional[float] = None
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self.started_at if self.started_at else 0
+        return {
+            "queue_depth" : self.queue.qsize(),
+            "busy" : self.busy,
+            "processed" : self.processed,
+            "emitted" : self.emitted,
+            "dropped" : self.dropped,
+            "failed" : self.failed,
+            "per_second" : round(self.processed / elapsed, 3) if elapsed else 0.0,
+        }
+
+
+class Pipeline:
+    """
+    Stages linked by bounded queues. Items go in with `put`, `close` waits for
+    everything already put to drain through every stage.
+    `on_settled(item, ok)` is awaited once for every item that leaves the pipeline:
+    dropped by a stage (its handler emitted nothing), failed (its handler raised),
+    or done with the last stage.
+    """
+    def __init__(self, stages:list[PipelineStage], on_settled:Optional[Callable[[Any, bool], Awaitable[None]]] = None):
+        self.stages = stages
+        self.on_settled = on_settled
+        for stage, next_stage in zip(stages, stages[1:]):
+            stage.next_stage = next_stage
+
+    def start(self):
+        for stage in self.stages:
+            stage.started_at = time.monotonic()
+            stage.workers = [asyncio.create_task(self._work(stage), name=f"pipeline-{stage.name}-{index}") for index in range(stage.concurrency)]
+
+    async def put(self, item):
+        await self.stages[0].queue.put(item)
+
+    async def close(self):
+        """Let every stage finish what it has, in order, then stop its workers."""
+        for stage in self.stages:
+            for _ in stage.workers:
+                await stage.queue.put(_DONE)
+            await asyncio.gather(*stage.workers)
+
+    async def cancel(self):
+        for stage in self.stages:
+            for worker in stage.workers:
+                worker.cancel()
+        await asyncio.gather(*(worker for stage in self.stages for worker in stage.workers), return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {stage.name : stage.stats() for stage in self.stages}
+
+    def format_stats(self) -> str:
+        return " | ".join(
+            f"{name}: queued {stats['queue_depth']}, busy {stats['busy']}, done {stats['processed']} ({stats['per_second']}/s)"
+            for name, stats in self.stats().items()
+        )
+
+    async def report(self, interval:float):
+        """Print queue depth and throughput of every stage every `interval` seconds, until cancelled."""
+        while True:
+            await asyncio.sleep(interval)
+            print(f"Pipeline - {self.format_stats()}")
+
+    async def _settle(self, item, ok:bool):
+        if self.on_settled:
+            try:
+                await self.on_settled(item, ok)
+            except Exception as e:
+                print(f"Error settling pipeline item: {e}")
+                traceback.print_exc()
+
+    async def _work(self, stage:PipelineStage):
+        while True:
+            item = await stage.queue.get()
+            if item is _DONE:
+                return
+            emitted = 0
+
+            async def emit(next_item):
+                nonlocal emitted
+                emitted += 1
+                stage.emitted += 1
+                await stage.next_stage.queue.put(next_item)
+
+            stage.busy += 1
+            try:
+                await stage.handler(item, emit if stage.next_stage else None)
+            except Exception as e:
+                stage.failed += 1
+                print(f"Pipeline stage '{stage.name}' failed: {e}")
+                traceback.print_exc()
+                if not emitted:
+                    await self._settle(item, False)
+                continue
+            finally:
+                stage.busy -= 1
+                stage.processed += 1
+            if not emitted:
+                if stage.next_stage:
+                    stage.dropped += 1
+                await self._settle(item, True)
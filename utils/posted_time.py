@@ -0,0 +1,38 @@
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+UNIT_SECONDS = {
+    "second" : 1,
+    "minute" : 60,
+    "hour" : 3600,
+    "day" : 86400,
+    "week" : 7 * 86400,
+    "month" : 30 * 86400,
+    "year" : 365 * 86400,
+}
+
+RELATIVE_TIME = re.compile(r"(\d+|an?|one)\s+(second|minute|hour|day|week|month|year)s?\s+ago")
+LAST_UNIT = re.compile(r"(?:last|a)\s+(second|minute|hour|day|week|month|year)\b")
+
+def parse_posted_at(text:str, now:Optional[datetime] = None) -> Optional[datetime]:
+    """
+    Turn the "Posted 5 minutes ago" style text of a job tile into a UTC timestamp.
+    Returns None when the text is not understood.
+    """
+    if not text:
+        return None
+    now = now or datetime.now(timezone.utc)
+    text = text.lower()
+    if "just now" in text or "moments ago" in text:
+        return now
+    if "yesterday" in text:
+        return now - timedelta(days=1)
+    match = RELATIVE_TIME.search(text)
+    if match:
+        amount = 1 if match.group(1) in ("a", "an", "one") else int(match.group(1))
+        return now - timedelta(seconds=amount * UNIT_SECONDS[match.group(2)])
+    match = LAST_UNIT.search(text)
+    if match:
+        return now - timedelta(seconds=UNIT_SECONDS[match.group(1)])
+    return None
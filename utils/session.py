@@ -1,38 +1,52 @@
-from utils.constants import upwork_login_url, cloudfare_challenge_div_id, upwork_url, home_url
+from utils.constants import upwork_login_url, cloudfare_challenge_div_id, upwork_url, home_url, login_state_ttl, login_cookie_names
 
 from nyx.page import NyxPage
+from db_utils.queue_manager import add_task_message
+from db_utils.outbox import enqueue_outbox_event
 
-from httpx import AsyncClient
 from pydantic import BaseModel
 import asyncio
+import time
+from urllib.parse import urlparse
+
+logged_in_selector = 'section[data-test="freelancer-sidebar-profile"]'
+
+class LoginState:
+    """
+    Which account the shared browser context is logged in as, and when that was last
+    verified. There is one browser per process, so one LoginState is shared by every session.
+    """
+    def __init__(self):
+        self.username = None
+        self.verified_at = 0.0
+
+    def remember(self, username:str):
+        self.username = username
+        self.verified_at = time.monotonic()
+
+    def forget(self):
+        self.username = None
+        self.verified_at = 0.0
+
+    def is_fresh(self, username:str, ttl:float = login_state_ttl) -> bool:
+        return self.username == username and time.monotonic() - self.verified_at < ttl
+
+login_state = LoginState()
 
 class Session:
-    def __init__(self, task_id:int, page:NyxPage, username: str, password: str, security_answer: str = None, status_endpoint:str = None, payload_endpoint:str = None, payload:BaseModel = None):
+    def __init__(self, task_id:int, page:NyxPage, username: str, password: str, security_answer: str = None, status_endpoint:str = None, payload_endpoint:str = None, payload:BaseModel = None, worker_id:str = None):
         self.task_id = task_id
+        # The worker holding the task, its status is only written while the lease is still ours
+        self.worker_id = worker_id
         self.username = username
         self.password = password
         self.security_answer = security_answer
-        self.client = None
         self.page = page
         self.payload:BaseModel = payload
         self.status_endpoint = status_endpoint
         self.payload_endpoint = payload_endpoint
         self.status = {}
     
-    async def setup_client(self):
-        try:
-            self.client = AsyncClient()
-            return True 
-        except Exception as e:
-            self.update_status("Failed", f"Error setting up HTTP client: {e}")
-            # self.send_status()
-            self.print_status()
-            return False
-        
-    async def close_client(self):
-        if self.client:
-            await self.client.aclose()
-            
     def update_status(self, status:str, message:str):
         self.status["status"] = status
         self.status["message"] = message
@@ -41,14 +55,68 @@ class Session:
             await self.page.click('button[aria-describedby="options-theme-popover"]')
             await asyncio.sleep(0.5)
             await self.page.click('button[data-cy="logout-trigger"]')
+            login_state.forget()
             await asyncio.sleep(2)
         except Exception as e:
             raise e
+
+    async def has_login_cookies(self) -> bool:
+        """True when the browser context holds unexpired Upwork session cookies."""
+        now = time.time()
+        cookies = await self.page.context.cookies(upwork_url)
+        # Session cookies have expires == -1
+        valid = {cookie["name"] for cookie in cookies if cookie.get("expires", -1) < 0 or cookie["expires"] > now}
+        return all(name in valid for name in login_cookie_names)
+
+    async def is_logged_in(self) -> bool:
+        """
+        Cheap login check, no page load: trusts a login of this account verified on a page
+        within login_state_ttl, as long as the context still holds the session cookies.
+        Cookies alone do not prove the server side session is alive, so they never extend
+        the TTL, only a page showing the logged in sidebar does.
+        """
+        if not login_state.is_fresh(self.username):
+            return False
+        try:
+            if await self.has_login_cookies():
+                return True
+        except Exception as e:
+            print(f"Could not read the browser cookies: {e}")
+        login_state.forget()
+        return False
+
+    def check_login_redirect(self, page:NyxPage = None) -> bool:
+        """
+        True when `page` was sent to the login page. The cached login state is dropped,
+        so the next login() goes through the login page.
+        """
+        page = page or self.page
+        try:
+            redirected = urlparse(page.url).path == urlparse(upwork_login_url).path
+        except Exception:
+            return False
+        if redirected:
+            login_state.forget()
+            print("Redirected to the login page, the browser session has expired")
+        return redirected
+
+    async def wait_for_login(self, timeout:float = 15000) -> bool:
+        try:
+            await self.page.wait_for_selector(logged_in_selector, timeout=timeout)
+            return True
+        except Exception:
+            return False
                     
     async def login(self, remember_me:bool = True, to_scrape:bool = False):
+        if await self.is_logged_in():
+            self.update_status("Success", "Already logged in")
+            print("Login state is still valid, skipping the login page")
+            # Nothing to navigate to: an application opens its job page next, and a scrape
+            # opens the feed itself (see ScraperSession.open_best_match)
+            return True
         try:
             await self.page.goto(upwork_login_url,captcha_selector=cloudfare_challenge_div_id,wait_until= "domcontentloaded",referer=upwork_url) 
-            logged_in = await self.page.check_for_element('section[data-test="freelancer-sidebar-profile"]')
+            logged_in = await self.page.check_for_element(logged_in_selector)
             if logged_in:
                 print("Already logged in")
                 logged_in_user = await self.page.get_text_content('a.profile-title')
@@ -68,14 +136,25 @@ class Session:
                 await asyncio.sleep(3)
                 if self.security_answer and await self.page.check_for_element('#login_answer'):
                     await self.page.fill_field_and_enter('#login_answer', self.security_answer)
-            elif await self.page.check_for_element('section[data-test="freelancer-sidebar-profile"]'):
+                if not await self.wait_for_login():
+                    login_state.forget()
+                    await self.send_status("Failed", "Login did not reach the home page")
+                    self.print_status()
+                    return False
+                login_state.remember(self.username)
+                self.update_status("Success", "Logged in")
+                return True
+            elif await self.page.check_for_element(logged_in_selector):
+                login_state.remember(self.username)
                 self.update_status("Success", "Already logged in")
                 return True
             else:
+                login_state.forget()
                 await self.send_status("Failed", "Login page not found")
                 self.print_status()
                 return False
         except Exception as e:
+            login_state.forget()
             await self.send_status("Failed", f"Error during login: {e}")
             self.print_status()
             await self.page.goto(home_url)
@@ -89,12 +168,17 @@ class Session:
             self.status["status"] = "Failed"
             self.status["message"] = "Set the status_endpoint parameter in Session initialisation."
             return False
-        if not self.client:
-            await self.setup_client()
         try:
             if status and message:
                 self.update_status(status, message)
-            await self.client.post(self.status_endpoint, json=self.status)
+            # Snapshot before awaiting, concurrent scrapes of the same session may update the status meanwhile
+            current_status = dict(self.status)
+            if self.task_id is not None and current_status:
+                await add_task_message(self.task_id, current_status.get("status"), current_status.get("message"))
+            # Delivered by the WebhookDispatcher, a slow or failing webhook never holds up the session
+            queued, msg = await enqueue_outbox_event(self.status_endpoint, current_status, self.task_id)
+            if not queued:
+                raise RuntimeError(msg)
             return True
         except Exception as e:
             self.status["status"] = "Failed"
@@ -104,16 +188,17 @@ class Session:
     def print_status(self):
         print(f"{self.status["status"]} -- {self.status["message"]}")
         
-    async def send_payload(self):
+    async def send_payload(self, payload:BaseModel = None):
+        payload = payload or self.payload
         if not self.payload_endpoint:
             self.status["status"] = "Failed"
             self.status["message"] = "Set the payload_endpoint parameter in Session initialisation."
             return False
-        if not self.client:
-            await self.setup_client()
         try:
-            print(self.payload.model_dump_json())
-            await self.client.post(self.payload_endpoint, json=self.payload.model_dump())
+            print(payload.model_dump_json())
+            queued, msg = await enqueue_outbox_event(self.payload_endpoint, payload.model_dump(), self.task_id)
+            if not queued:
+                raise RuntimeError(msg)
             return True
         except Exception as e:
             self.status["status"] = "Failed"
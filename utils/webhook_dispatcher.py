@@ -0,0 +1,108 @@
+import asyncio
+import traceback
+from typing import Optional
+
+from httpx import AsyncClient
+
+from db_utils.outbox import claim_outbox_events, mark_outbox_delivered, mark_outbox_failed, release_outbox_events, seconds_until_next_outbox_event
+from db_utils.queue_listener import QueueListener, wait_for_notification
+from utils.constants import outbox_channel, outbox_batch_size, outbox_dispatch_concurrency, outbox_fallback_poll_interval
+
+class WebhookDispatcher:
+    """
+    Drains the webhook_outbox table in batches: claims due events, posts each one to
+    its endpoint over one keep-alive client and acknowledges the batch with a single
+    UPDATE. Failed posts go back to the outbox with backoff. An event is only marked
+    delivered after its endpoint answered 2xx, so it may be delivered twice but never lost.
+    Events of the same task are posted one at a time in outbox order, different tasks
+    concurrently, so a receiver never sees a task's updates out of order.
+    """
+    def __init__(self, listener:QueueListener, client:Optional[AsyncClient] = None, batch_size:int = outbox_batch_size, concurrency:int = outbox_dispatch_concurrency):
+        self.listener = listener
+        self.client = client
+        self.owns_client = client is None
+        self.batch_size = batch_size
+        self.post_limit = asyncio.Semaphore(concurrency)
+        self.task: Optional[asyncio.Task] = None
+        self.wakeups: Optional[asyncio.Queue] = None
+        self.delivered = 0
+        self.failed = 0
+
+    async def start(self):
+        if self.client is None:
+            self.client = AsyncClient()
+        self.wakeups = await self.listener.subscribe(outbox_channel)
+        self.task = asyncio.create_task(self.run(), name="webhook-dispatcher")
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        if self.wakeups:
+            self.listener.unsubscribe(outbox_channel, self.wakeups)
+        if self.owns_client and self.client:
+            await self.client.aclose()
+
+    async def run(self):
+        while True:
+            try:
+                events = await claim_outbox_events(self.batch_size)
+                if events:
+                    await self.deliver(events)
+                    # A full batch means there is probably more waiting
+                    continue
+                await self.listener.ensure_connected()
+                timeout = outbox_fallback_poll_interval
+                next_due = await seconds_until_next_outbox_event()
+                if next_due is not None:
+                    timeout = min(timeout, max(next_due, 0.1))
+                await wait_for_notification(self.wakeups, timeout=timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error in webhook dispatcher: {e}")
+                traceback.print_exc()
+                await asyncio.sleep(3)
+
+    async def deliver(self, events:list[dict]):
+        groups: dict[object, list[dict]] = {}
+        for event in events:
+            # Events without a task have no order to keep
+            key = event["task_id"] if event["task_id"] is not None else ("event", event["id"])
+            groups.setdefault(key, []).append(event)
+        results = await asyncio.gather(*(self.deliver_in_order(group) for group in groups.values()))
+        delivered_ids = [event_id for delivered, _, _ in results for event_id in delivered]
+        await mark_outbox_delivered(delivered_ids)
+        self.delivered += len(delivered_ids)
+        for _, failure, unsent in results:
+            if failure is not None:
+                event, error = failure
+                self.failed += 1
+                print(f"Webhook event {event['id']} to {event['endpoint']} failed (attempt {event['attempts']}): {error}")
+                await mark_outbox_failed(event["id"], event["attempts"], error)
+            # Held back until the failed event before them goes through, see claim_outbox_events
+            await release_outbox_events(unsent)
+
+    async def deliver_in_order(self, group:list[dict]):
+        """
+        Post the events of one task in order, stopping at the first failure.
+        Returns (delivered_ids, (failed_event, error) or None, ids_not_sent).
+        """
+        delivered = []
+        for index, event in enumerate(group):
+            error = await self.post(event)
+            if error is not None:
+                return delivered, (event, error), [later["id"] for later in group[index + 1:]]
+            delivered.append(event["id"])
+        return delivered, None, []
+
+    async def post(self, event:dict) -> Optional[str]:
+        """Post one event, returns None on success or the error message."""
+        async with self.post_limit:
+            try:
+                response = await self.client.post(event["endpoint"], json=event["payload"])
+                response.raise_for_status()
+                return None
+            except Exception as e:
+                return str(e) or type(e).__name__
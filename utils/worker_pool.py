@@ -0,0 +1,224 @@
+import asyncio
+import traceback
+from typing import Awaitable, Callable, Optional
+
+from db_utils.queue_manager import get_next_task, extend_task_leases, fail_task, seconds_until_next_due_task, update_task_status
+from db_utils.queue_listener import QueueListener, wait_for_notification
+from nyx.page_pool import PagePool
+from utils.constants import task_queue_channel, worker_fallback_poll_interval, task_heartbeat_interval, task_type_scheduling, \
+    task_cancel_channel, task_type_deadlines, default_task_deadline
+
+TaskHandler = Callable[..., Awaitable[None]]
+
+class FairShareScheduler:
+    """
+    Start-time fair queuing between task types.
+    Every claim of a type advances its virtual time by 1/weight, and the lane
+    prefers the type with the lowest virtual time that has due work, so over
+    time each busy type gets a share of claims proportional to its weight.
+    """
+    def __init__(self, task_types:list[str], weights:Optional[dict[str, float]] = None):
+        weights = weights or {}
+        self.weights = {task_type: float(weights.get(task_type, task_type_scheduling.get(task_type, {}).get("weight", 1))) for task_type in task_types}
+        self.virtual_time = {task_type: 0.0 for task_type in task_types}
+        self.clock = 0.0
+
+    def order(self, task_types:list[str]) -> list[str]:
+        return sorted(task_types, key=lambda task_type: self.virtual_time[task_type])
+
+    def charge(self, task_type:str):
+        # A type that sat idle restarts from the current clock instead of bursting through its backlog
+        start = max(self.virtual_time[task_type], self.clock)
+        self.clock = start
+        self.virtual_time[task_type] = start + 1 / self.weights[task_type]
+
+
+class WorkerLane:
+    """
+    A group of consumers sharing one concurrency budget.
+    Browser lanes get their budget from a PagePool (one tab per running task),
+    other lanes (LLM / DB only) just run `concurrency` consumers.
+    `type_limits` optionally caps how many tasks of a type run at once in the lane.
+    """
+    def __init__(self, name:str, task_types:list[str], concurrency:int = 1, page_pool:Optional[PagePool] = None, type_limits:Optional[dict[str, int]] = None):
+        self.name = name
+        self.task_types = task_types
+        self.page_pool = page_pool
+        self.concurrency = page_pool.size() if page_pool else concurrency
+        self.type_limits = type_limits or {}
+        self.running: dict[str, int] = {task_type: 0 for task_type in task_types}
+        self.scheduler = FairShareScheduler(task_types)
+        # Serialises "check limits -> claim -> count" so two consumers cannot overshoot a type limit
+        self.claim_lock = asyncio.Lock()
+
+    def claimable_task_types(self) -> list[str]:
+        """Task types this lane has room for right now, in fair-share preference order."""
+        return self.scheduler.order([
+            task_type for task_type in self.task_types
+            if self.running[task_type] < self.type_limits.get(task_type, self.concurrency)
+        ])
+
+
+class WorkerSupervisor:
+    """Runs the consumers of every lane and dispatches claimed tasks to their handlers."""
+    def __init__(self, worker_id:str, listener:QueueListener, handlers:dict[str, TaskHandler], lanes:list[WorkerLane]):
+        self.worker_id = worker_id
+        self.listener = listener
+        self.handlers = handlers
+        self.lanes = lanes
+        self.consumers: list[asyncio.Task] = []
+        self.running_tasks: dict[int, asyncio.Task] = {}
+        self.cancel_requested: set[int] = set()
+        self.lost_leases: set[int] = set()
+
+    async def start(self):
+        cancellations = await self.listener.subscribe(task_cancel_channel)
+        self.consumers.append(asyncio.create_task(self.watch_cancellations(cancellations), name="cancel-watcher"))
+        for lane in self.lanes:
+            for index in range(lane.concurrency):
+                wakeups = await self.listener.subscribe(task_queue_channel)
+                consumer = asyncio.create_task(self.consume(lane, wakeups, f"{self.worker_id}/{lane.name}-{index}"), name=f"{lane.name}-{index}")
+                self.consumers.append(consumer)
+            print(f"Lane '{lane.name}' started with {lane.concurrency} consumers for {lane.task_types}")
+
+    async def stop(self):
+        for consumer in self.consumers:
+            consumer.cancel()
+        await asyncio.gather(*self.consumers, return_exceptions=True)
+        self.consumers = []
+
+    async def consume(self, lane:WorkerLane, wakeups:asyncio.Queue, consumer_id:str):
+        """
+        Claim and run tasks for `lane`. Tasks are claimed as `consumer_id`, not the process
+        wide worker id, so a task requeued after its lease ran out and claimed again by
+        another consumer of this process is not mistaken for the one still running.
+        """
+        while True:
+            page = None
+            try:
+                if lane.page_pool:
+                    page = await lane.page_pool.get_idle_page()
+                async with lane.claim_lock:
+                    task_types = lane.claimable_task_types()
+                    status, task = await get_next_task(worker_id=consumer_id, task_types=task_types) if task_types else (False, "Lane is full")
+                    if status:
+                        lane.running[task['task_type']] += 1
+                        lane.scheduler.charge(task['task_type'])
+                if status:
+                    # run_task owns the page from here on and releases it when done
+                    claimed_page, page = page, None
+                    await self.run_task(lane, task, claimed_page)
+                    # Look for the next task straight away, the queue may not be empty yet
+                    continue
+                if page:
+                    await lane.page_pool.release(page, reset=False)
+                    page = None
+                await self.listener.ensure_connected()
+                # Delayed retries do not NOTIFY when they become due, so wake up for the earliest one
+                timeout = worker_fallback_poll_interval
+                next_due = await seconds_until_next_due_task(lane.task_types)
+                if next_due is not None:
+                    timeout = min(timeout, max(next_due, 0.1))
+                await wait_for_notification(wakeups, timeout=timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error in lane '{lane.name}': {e}")
+                traceback.print_exc()
+                if page:
+                    await lane.page_pool.release(page)
+                await asyncio.sleep(3)
+
+    async def run_task(self, lane:WorkerLane, task:dict, page=None):
+        task_id = task['id']
+        task_type = task['task_type']
+        worker_id = task['worker_id']
+        deadline = task_type_deadlines.get(task_type, default_task_deadline)
+        print(f"[{lane.name}] Processing task {task_id}: {task_type} (deadline {deadline}s)")
+        handler = self.handlers[task_type](task, page=page) if page else self.handlers[task_type](task)
+        handler_task = asyncio.create_task(handler)
+        self.running_tasks[task_id] = handler_task
+        heartbeat = asyncio.create_task(self.heartbeat_loop(task_id, worker_id, handler_task))
+        reset_page = True
+        try:
+            await asyncio.wait_for(handler_task, timeout=deadline)
+        except asyncio.TimeoutError:
+            print(f"[{lane.name}] Task {task_id} exceeded its {deadline}s deadline")
+            await self.stop_page(page)
+            reset_page = False
+            await update_task_status(task_id, "timed_out", result={"status" : "Failed", "message" : f"Deadline of {deadline}s exceeded"}, worker_id=worker_id)
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                # The supervisor itself is shutting down
+                raise
+            if task_id in self.lost_leases:
+                # The task was requeued, its row belongs to whoever holds it now
+                print(f"[{lane.name}] Task {task_id} stopped, its lease was lost")
+            elif task_id in self.cancel_requested:
+                print(f"[{lane.name}] Task {task_id} cancelled")
+                await update_task_status(task_id, "cancelled", result={"status" : "Failed", "message" : "Cancelled by request"}, worker_id=worker_id)
+            else:
+                raise
+            await self.stop_page(page)
+            reset_page = False
+        except Exception as e:
+            print(f"[{lane.name}] Task {task_id} raised: {e}")
+            traceback.print_exc()
+            await fail_task(task_id, error={"status" : "Failed", "message" : str(e)}, worker_id=worker_id)
+        finally:
+            heartbeat.cancel()
+            self.running_tasks.pop(task_id, None)
+            self.cancel_requested.discard(task_id)
+            self.lost_leases.discard(task_id)
+            lane.running[task_type] -= 1
+            if page:
+                await lane.page_pool.release(page, reset=reset_page)
+
+    def track_task(self, task_id:int, handler_task:asyncio.Task):
+        """
+        Route cancellation requests of `task_id` to `handler_task`. For tasks a handler
+        claimed on its own (apply_batch), which the consumers never see.
+        """
+        self.running_tasks[task_id] = handler_task
+
+    def untrack_task(self, task_id:int) -> bool:
+        """Forget a task registered with track_task. Returns True if its cancellation was requested."""
+        self.running_tasks.pop(task_id, None)
+        cancel_requested = task_id in self.cancel_requested
+        self.cancel_requested.discard(task_id)
+        return cancel_requested
+
+    async def stop_page(self, page):
+        """Put a page abandoned mid-task back in a known state."""
+        if page:
+            await page.reset()
+
+    async def watch_cancellations(self, cancellations:asyncio.Queue):
+        while True:
+            task_id = int(await cancellations.get())
+            handler_task = self.running_tasks.get(task_id)
+            if handler_task:
+                self.cancel_requested.add(task_id)
+                handler_task.cancel()
+
+    async def heartbeat_loop(self, task_id:int, worker_id:str, handler_task:asyncio.Task):
+        """
+        Keep extending the lease on `task_id` while its handler runs. Once the lease is
+        lost the task may already run elsewhere, so the handler is stopped. A cancellation
+        recorded on the row stops the handler too, in case its NOTIFY was missed.
+        """
+        while True:
+            await asyncio.sleep(task_heartbeat_interval)
+            lease_status, held = await extend_task_leases([task_id], worker_id)
+            if not lease_status:
+                print(f"Heartbeat for task {task_id} failed - {held}")
+                continue
+            if task_id not in held:
+                print(f"Lease on task {task_id} lost, stopping it")
+                self.lost_leases.add(task_id)
+                handler_task.cancel()
+                return
+            if held[task_id] and task_id not in self.cancel_requested:
+                print(f"Cancellation of task {task_id} requested, stopping it")
+                self.cancel_requested.add(task_id)
+                handler_task.cancel()